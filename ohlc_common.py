@@ -0,0 +1,392 @@
+import json
+import datetime
+import logging
+import queue
+import threading
+import time
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+
+
+SECONDS_IN_DAY = 86400
+logger         = logging.getLogger("ohlc")
+
+
+## Metrics ##
+class Metrics:
+    """
+    counters and latency histograms, thread-safe.
+    Install with setMetrics(Metrics()); anything with count(name, value) and observe(name, seconds) works as well.
+    """
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.lock       = threading.Lock()
+        self.counters   = {}
+        self.histograms = {}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * (len(Metrics.buckets) + 1)}
+            histogram["count"] += 1
+            histogram["sum"]   += seconds
+            histogram["max"]    = max(histogram["max"], seconds)
+            histogram["buckets"][int(np.searchsorted(Metrics.buckets, seconds))] += 1
+
+    def snapshot(self) -> dict:
+        """ {counters: {name: value}, histograms: {name: {count, sum, max, buckets: {le: count}}}} """
+        with self.lock:
+            histograms = {}
+            for name, histogram in self.histograms.items():
+                bounds = [str(bound) for bound in Metrics.buckets] + ["inf"]
+                histograms[name] = {**histogram, "buckets": dict(zip(bounds, histogram["buckets"]))}
+            return {"counters": dict(self.counters), "histograms": histograms}
+
+    def dump(self, path):
+        with open(path, "w") as fp:
+            json.dump(self.snapshot(), fp, indent=1, sort_keys=True)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+_metrics = None
+
+
+def setMetrics(metrics):
+    """ installs the metrics sink used by the online and offline scripts, None disables metrics """
+    global _metrics
+    _metrics = metrics
+
+def getMetrics():
+    return _metrics
+
+def count(name, value=1):
+    if _metrics is not None:
+        _metrics.count(name, value)
+
+class timed:
+    """ with timed("stage"): ... records the duration of the block as a latency of stage when metrics are set """
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter() if _metrics is not None else None
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None and _metrics is not None:
+            _metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def dayKeyFromDate(date) -> int:
+    """ "2022-03-02" / datetime / Timestamp -> days since epoch """
+    return int(np.datetime64(pd.Timestamp(date).date(), "D").astype(np.int64))
+
+def wallEpochFromIndex(index: pd.DatetimeIndex) -> np.ndarray:
+    """ naive (wall-clock) datetime index -> int64 seconds, the same convention as the offline cache """
+    return np.asarray(index.values.astype("datetime64[s]").astype(np.int64))
+
+
+class DayIndex:
+    """
+    date -> [start, end) row offsets over a sorted array of wall-clock epochs.
+    Built once with binary search; slicing the underlying data with these offsets returns views,
+    so no per day copies are kept.
+    With session_open (seconds from midnight), rows of a day before the session open are left out.
+    """
+    def __init__(self, epoch: np.ndarray, session_open=None):
+        epoch       = np.asarray(epoch, dtype=np.int64)
+        days        = epoch // SECONDS_IN_DAY
+        self.keys   = np.unique(days)
+        day_starts  = self.keys * SECONDS_IN_DAY
+        self.starts = np.searchsorted(epoch, day_starts + (session_open or 0), side="left")
+        self.ends   = np.searchsorted(epoch, day_starts + SECONDS_IN_DAY, side="left")
+        if session_open:
+            keep = self.starts < self.ends
+            self.keys, self.starts, self.ends = self.keys[keep], self.starts[keep], self.ends[keep]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, date):
+        return self.position(date) is not None
+
+    def position(self, date):
+        """ position of date in keys, None if there is no data for date """
+        key = dayKeyFromDate(date)
+        pos = int(np.searchsorted(self.keys, key))
+        if pos < len(self.keys) and self.keys[pos] == key:
+            return pos
+        return None
+
+    def bounds(self, date):
+        """ [start, end) row offsets of date, raises KeyError when date is not present """
+        pos = self.position(date)
+        if pos is None:
+            raise KeyError(date)
+        return int(self.starts[pos]), int(self.ends[pos])
+
+    def dates(self) -> list:
+        return self.keys.astype("datetime64[D]").astype(str).tolist()
+
+    def nbytes(self) -> int:
+        return self.keys.nbytes + self.starts.nbytes + self.ends.nbytes
+
+
+## Resampling ##
+SESSION_OPEN = 9 * 3600 + 15 * 60      # 09:15, seconds from midnight
+OHLCV        = ["Open", "High", "Low", "Close", "Volume"]
+
+
+def binEpochs(epoch: np.ndarray, timeframe: int, session_open=SESSION_OPEN) -> np.ndarray:
+    """ start of the N minute bin each 1 minute bar falls in, bins anchored at session_open of its own day """
+    width = int(timeframe) * 60
+    day   = epoch - epoch % SECONDS_IN_DAY
+    return day + session_open + ((epoch - day - session_open) // width) * width
+
+def resample(epoch: np.ndarray, columns: dict, timeframe: int, session_open=SESSION_OPEN):
+    """
+    N minute OHLCV bars from bar-start labelled 1 minute bars, for any number of days in one pass.
+    Bars before the session open are ignored, bins are anchored at the session open of each day and
+    partial bins at the end of a session are kept.
+    Args:
+        epoch (np.ndarray)  : sorted wall-clock epochs (seconds) of the 1 minute bars
+        columns (dict)      : any of Open, High, Low, Close, Volume -> array aligned with epoch
+        timeframe (int)     : N minutes
+    Returns:
+        (np.ndarray, dict): epoch of each bin start, aggregated columns
+    """
+    with timed("resample"):
+        return _resample(epoch, columns, timeframe, session_open)
+
+def _resample(epoch, columns, timeframe, session_open):
+    epoch = np.asarray(epoch, dtype=np.int64)
+    keep  = (epoch % SECONDS_IN_DAY) >= session_open
+    if not keep.all():
+        epoch   = epoch[keep]
+        columns = {name: np.asarray(col)[keep] for name, col in columns.items()}
+    if len(epoch) == 0:
+        return epoch, {name: np.asarray(col)[:0] for name, col in columns.items()}
+
+    bins   = binEpochs(epoch, timeframe, session_open)
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    lasts  = np.r_[starts[1:], len(bins)] - 1
+    out    = {}
+    for name, col in columns.items():
+        col = np.asarray(col)
+        if name == "Open":
+            out[name] = col[starts]
+        elif name == "High":
+            out[name] = np.maximum.reduceat(col, starts)
+        elif name == "Low":
+            out[name] = np.minimum.reduceat(col, starts)
+        elif name == "Close":
+            out[name] = col[lasts]
+        elif name == "Volume":
+            out[name] = np.add.reduceat(col, starts)
+    return bins[starts], out
+
+def resampleDf(df: pd.DataFrame, timeframe: int, session_open=SESSION_OPEN, epoch=None) -> pd.DataFrame:
+    """
+    resample for a datetime (wall-clock, bar start) indexed OHLC(V) dataframe.
+    epoch can be passed when the bar start epochs differ from the index (offline data is labelled by bar end).
+    """
+    if epoch is None:
+        epoch = wallEpochFromIndex(df.index)
+    columns     = {name: df[name].to_numpy() for name in OHLCV if name in df.columns}
+    bins, out   = resample(epoch, columns, timeframe, session_open)
+    index       = pd.DatetimeIndex(bins.astype("datetime64[s]"), name="date_time")
+    return pd.DataFrame(out, index=index, columns=list(columns))
+
+
+## Streaming ##
+_DONE = object()
+
+
+def prefetch(iterable, depth=2):
+    """
+    iterates over iterable on a background thread, keeping at most depth items ready ahead of the consumer,
+    so producing the next item (file reads, downloads) overlaps with the work done on the current one.
+    Exceptions of the producer are raised in the consumer.
+    """
+    items = queue.Queue(maxsize=max(1, int(depth)))
+    stop  = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((_DONE, e))
+            return
+        put((_DONE, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+class DayMap(Mapping):
+    """
+    read-only {date: day dataframe} over a datetime indexed frame; days are sliced on access, nothing is copied.
+    """
+    def __init__(self, df: pd.DataFrame, session_open=None):
+        self.df        = df
+        self.day_index = DayIndex(wallEpochFromIndex(df.index), session_open)
+
+    def __getitem__(self, date):
+        start, end = self.day_index.bounds(date)
+        return self.df.iloc[start:end]
+
+    def __iter__(self):
+        return iter(self.day_index.dates())
+
+    def __len__(self):
+        return len(self.day_index)
+
+    def __contains__(self, date):
+        return date in self.day_index
+
+def daySlice(df: pd.DataFrame, date, session_open=None) -> pd.DataFrame:
+    """ rows of one date of a sorted datetime indexed frame, by binary search on the index; no full split """
+    day   = pd.Timestamp(date).normalize()
+    start = df.index.searchsorted(day + pd.Timedelta(seconds=session_open or 0), side="left")
+    end   = df.index.searchsorted(day + pd.Timedelta(days=1), side="left")
+    return df.iloc[start:end]
+
+def boundEpoch(value, end=False) -> int:
+    """
+    wall-clock epoch (seconds) of a range bound: "2022-03-02", "2022-03-02 14:00", datetime, Timestamp or an int epoch.
+    A date without a time used as end bound covers that whole day.
+    """
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    stamp = pd.Timestamp(value)
+    if stamp.tzinfo is not None:
+        stamp = stamp.tz_localize(None)     # keep the wall clock
+    epoch = int(stamp.value // 10**9)
+    whole_day = (isinstance(value, str) and len(value.strip()) <= 10) or type(value) is datetime.date
+    return epoch + SECONDS_IN_DAY - 1 if (end and whole_day) else epoch
+
+def rangeBounds(epoch: np.ndarray, start=None, end=None):
+    """ [lo, hi) positions of a sorted epoch array within [start, end], both inclusive, by binary search """
+    lo = 0 if start is None else int(np.searchsorted(epoch, boundEpoch(start), side="left"))
+    hi = len(epoch) if end is None else int(np.searchsorted(epoch, boundEpoch(end, end=True), side="right"))
+    return lo, max(lo, hi)
+
+def rangeSlice(df: pd.DataFrame, start=None, end=None) -> pd.DataFrame:
+    """ rows of a sorted wall-clock datetime indexed frame within [start, end]; a slice, df is left untouched """
+    lo = 0 if start is None else df.index.searchsorted(pd.Timestamp(boundEpoch(start), unit="s"), side="left")
+    hi = len(df) if end is None else df.index.searchsorted(pd.Timestamp(boundEpoch(end, end=True), unit="s"), side="right")
+    return df.iloc[lo:max(lo, hi)]
+
+def iterDayFrames(df: pd.DataFrame, start=None, end=None):
+    """ (date, day slice) of a wall-clock datetime indexed frame in chronological order, limited to [start, end] dates """
+    day_index = DayIndex(wallEpochFromIndex(df.index))
+    first     = dayKeyFromDate(start) if start is not None else None
+    last      = dayKeyFromDate(end) if end is not None else None
+    for key, date, row_start, row_end in zip(day_index.keys, day_index.dates(), day_index.starts, day_index.ends):
+        if (first is not None and key < first) or (last is not None and key > last):
+            continue
+        yield date, df.iloc[row_start:row_end]
+
+
+## Live ##
+class LiveBars:
+    """
+    1 minute bars of one session plus N minute bars kept up to date incrementally.
+    update() takes bars newer than (or equal to, for the still forming one) the last bar seen; every N minute bin
+    touched is rebuilt from its at most N one minute bars, so a tick costs the same at 09:16 and at 15:29.
+    N minute bins follow resample(): anchored at the session open, bars before the open are left out.
+    """
+    def __init__(self, timeframes=(1,), session_open=SESSION_OPEN):
+        self.session_open = session_open
+        self.timeframes   = sorted({int(tf) for tf in timeframes} | {1})
+        self.bars         = {tf: {name: [] for name in ["epoch"] + OHLCV} for tf in self.timeframes}
+
+    def lastEpoch(self):
+        epochs = self.bars[1]["epoch"]
+        return epochs[-1] if epochs else None
+
+    def _put(self, tf, epoch, values):
+        """ appends the bar, or replaces the last one when it has the same epoch """
+        bars = self.bars[tf]
+        if bars["epoch"] and bars["epoch"][-1] == epoch:
+            for name in OHLCV:
+                bars[name][-1] = values[name]
+        else:
+            bars["epoch"].append(epoch)
+            for name in OHLCV:
+                bars[name].append(values[name])
+
+    def _rebuild(self, tf, bin_start):
+        minute = self.bars[1]
+        first  = len(minute["epoch"])
+        while first > 0 and minute["epoch"][first - 1] >= bin_start:
+            first -= 1
+        self._put(tf, bin_start, {
+            "Open"  : minute["Open"][first],
+            "High"  : max(minute["High"][first:]),
+            "Low"   : min(minute["Low"][first:]),
+            "Close" : minute["Close"][-1],
+            "Volume": sum(minute["Volume"][first:])})
+
+    def update(self, epoch, columns) -> int:
+        """
+        Args:
+            epoch (array)  : wall-clock epochs (seconds) of 1 minute bars, bar start labelled, ascending
+            columns (dict) : Open, High, Low, Close and optionally Volume arrays aligned with epoch
+        Returns:
+            int: number of 1 minute bars added or revised
+        """
+        epoch   = np.asarray(epoch, dtype=np.int64).tolist()
+        columns = {name: np.asarray(columns[name], dtype=np.float64).tolist() if name in columns else [0.0] * len(epoch)
+                   for name in OHLCV}
+        changed = 0
+        for i, t in enumerate(epoch):
+            last = self.lastEpoch()
+            if last is not None and t < last:
+                continue        # already final
+            self._put(1, t, {name: columns[name][i] for name in OHLCV})
+            changed += 1
+            if (t % SECONDS_IN_DAY) < self.session_open:
+                continue
+            for tf in self.timeframes[1:]:
+                self._rebuild(tf, int(binEpochs(np.int64(t), tf, self.session_open)))
+        return changed
+
+    def df(self, tf=1) -> pd.DataFrame:
+        bars  = self.bars[int(tf)]
+        index = pd.DatetimeIndex(np.asarray(bars["epoch"], dtype=np.int64).astype("datetime64[s]"), name="date_time")
+        return pd.DataFrame({name: bars[name] for name in OHLCV}, index=index, columns=OHLCV)
@@ -1,32 +1,347 @@
 import pandas as pd
+import numpy as np
 import glob
+import fnmatch
+import hashlib
+import json
 import os
-from multiprocessing import Pool
+import uuid
+import zipfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+try:
+    from .ohlc_common import DayIndex, SECONDS_IN_DAY, SESSION_OPEN, resample, resampleDf, rangeBounds, boundEpoch, wallEpochFromIndex, prefetch, iterDayFrames, logger, count, timed
+except ImportError:
+    from ohlc_common import DayIndex, SECONDS_IN_DAY, SESSION_OPEN, resample, resampleDf, rangeBounds, boundEpoch, wallEpochFromIndex, prefetch, iterDayFrames, logger, count, timed
 
 
-DIR_DATA = "data\\"
+DIR_DATA  = "data"
+DIR_CACHE = ".cache"        # lives inside DIR_DATA
+MANIFEST  = "manifest.json"
+CACHE_VERSION = 2           # bump when the cached arrays change meaning, cached files of other versions are re-parsed
+COLUMNS   = ["Open", "High", "Low", "Close"]
+WORKERS   = 1          # processes parsing text files; 0 or less uses os.cpu_count()
+BAR_CACHE_BUDGET = 256 * 1024 * 1024   # bytes of resampled bars kept in memory per data source
+COMPACT_DTYPE = np.float32   # prices of compact sources; exact to the paisa below ~80000
+ARCHIVES  = "Intraday *.zip"   # zipped text files next to the extracted ones, read without extracting
+MEMBER    = "::"               # "{archive}::{member}" names a text file inside an archive
+# data quality pass at ingest; stamps of the text files label the end of the minute
+PREOPEN       = 9 * 3600              # stamps in [PREOPEN, SESSION_OPEN) are the pre-open auction, moved to 09:15
+SESSION_CLOSE = 15 * 3600 + 30 * 60
+OPEN_FILL     = 5                     # a day whose first bar is at most this many minutes late gets a flat 09:15 bar
+LATE_ROWS     = 15 * 60               # rows later than this after the close make a non-standard session
+QUALITY_DTYPE = np.dtype([("day", "i8"), ("bars", "i4"), ("preopen", "i4"), ("synthetic_open", "?"),
+                          ("duplicates", "i4"), ("out_of_order", "i4"), ("gaps", "i4"), ("non_standard", "?")])
+MONTHS    = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
 
 
+_archive_members = {}        # archive -> ((mtime, size), {member: (crc, size)})
+
+
+def _splitMember(filename):
+    """ "{archive}::{member}" -> (archive, member); (None, filename) for a plain file """
+    archive, sep, member = filename.partition(MEMBER)
+    return (archive, member) if sep else (None, filename)
+
+def _sourceName(filename):
+    """ file name of a text file or of an archive member, e.g. "2015 JAN BNF.txt" """
+    return os.path.basename(_splitMember(filename)[1])
+
+def _archiveMembers(archive):
+    """ text members of archive -> (crc, size), the directory of the archive is read once per archive version """
+    stat    = os.stat(archive)
+    version = (stat.st_mtime, stat.st_size)
+    cached  = _archive_members.get(archive)
+    if cached is None or cached[0] != version:
+        with zipfile.ZipFile(archive) as zf:
+            members = {info.filename: (info.CRC, info.file_size) for info in zf.infolist()
+                       if not info.is_dir() and info.filename.lower().endswith(".txt")}
+        cached = _archive_members[archive] = (version, members)
+    return cached[1]
+
 def _getFiles(ticker="BNF", filepath=None):
-    file_path = os.path.join(os.path.dirname(__file__), DIR_DATA) + "*{}.txt".format(ticker)
+    """
+    text files matching the glob and the matching members of the ARCHIVES in the same directory, as "{archive}::{member}".
+    An extracted file wins over an archive member of the same name.
+    """
+    file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), DIR_DATA, "*{}.txt".format(ticker))
     if filepath is not None:
         file_path = filepath
-    files =  glob.glob(file_path)
-    return files
+    files   = glob.glob(file_path)
+    names   = {os.path.basename(file) for file in files}
+    pattern = os.path.basename(file_path)
+    for archive in sorted(glob.glob(os.path.join(os.path.dirname(file_path), ARCHIVES))):
+        try:
+            members = _archiveMembers(archive)
+        except (OSError, zipfile.BadZipFile) as e:
+            logger.warning("skipping archive %s: %s", archive, e)
+            continue
+        for member in sorted(members):
+            name = os.path.basename(member)
+            if fnmatch.fnmatchcase(name, pattern) and name not in names:
+                files.append(f"{archive}{MEMBER}{member}")
+                names.add(name)
+    return sorted(files)
 
-def _getDf(filename):
-    print(f"reading file: {filename}")
-    df = pd.read_csv(filename, sep=",",
-                       names=["Ticker", "date", "time", "Open", "High", "Low", "Close"],
-                       index_col=False, parse_dates=[["date", "time"]])
-    
-    # replace all 9:08 with 9:15:00
-    mask = df['date_time'].dt.time == pd.to_datetime('09:08:00').time()
-    df.loc[mask, 'date_time'] = df["date_time"].dt.normalize() + pd.Timedelta('09:15:00')
-    
-    mask = df['date_time'].dt.time == pd.to_datetime('09:09:00').time()
-    df.loc[mask, 'date_time'] = df["date_time"].dt.normalize() + pd.Timedelta('09:15:00')
-    
+def _getMonthOfFile(filename):
+    """ "2022 MAR BNF.txt" / "2021 JULY BNF.txt" -> (2022, 3) / (2021, 7), None if the name has no year and month """
+    parts = _sourceName(filename).upper().split()
+    try:
+        return int(parts[0]), MONTHS.index(parts[1][:3]) + 1
+    except (IndexError, ValueError):
+        return None
+
+def _getMonthOfDate(date):
+    """ (year, month) of a date or range bound; int epochs are seconds, not the nanoseconds pd.Timestamp would read """
+    date = pd.Timestamp(np.datetime64(boundEpoch(date), "s"))
+    return date.year, date.month
+
+def _filterFilesByRange(files, start=None, end=None):
+    """ files whose month overlaps [start, end]; files without a month in their name are always kept """
+    first = _getMonthOfDate(start) if start is not None else None
+    last  = _getMonthOfDate(end) if end is not None else None
+    selected = []
+    for file in files:
+        month = _getMonthOfFile(file)
+        if month is None or ((first is None or month >= first) and (last is None or month <= last)):
+            selected.append(file)
+    return selected
+
+def _sortFilesByMonth(files):
+    return sorted(files, key=lambda file: _getMonthOfFile(file) or (0, 0))
+
+def _getCacheDir(filename):
+    archive, _ = _splitMember(filename)
+    return os.path.join(os.path.dirname(os.path.abspath(archive or filename)), DIR_CACHE)
+
+def _readCsv(filename, **kwargs):
+    """ read_csv of a text file, or of an archive member decompressed as it is read """
+    archive, member = _splitMember(filename)
+    if archive is None:
+        return pd.read_csv(filename, **kwargs)
+    with zipfile.ZipFile(archive) as zf, zf.open(member) as fp:
+        return pd.read_csv(fp, **kwargs)
+
+def _parseFile(filename):
+    """
+    parses one monthly text file into numpy arrays.
+    Returns:
+        ticker (str), epoch (int64, wall-clock seconds, IST read as UTC), ohlc (float64, shape (n, 4))
+    """
+    logger.info("reading file: %s", filename)
+    df = _readCsv(filename, sep=",", header=None, usecols=range(7),
+                     names=["Ticker", "date", "time"] + COLUMNS,
+                     dtype={"Ticker": str, "date": str, "time": str})
+    date_time = pd.to_datetime(df["date"] + df["time"], format="%Y%m%d%H:%M")
+    epoch     = date_time.to_numpy(dtype="datetime64[s]").astype(np.int64)
+    ohlc      = df[COLUMNS].to_numpy(dtype=np.float64)
+    ticker    = str(df["Ticker"].iloc[0]) if len(df) else ""
+    return (ticker,) + _repair(epoch, ohlc)
+
+def _repair(epoch, ohlc):
+    """
+    data quality pass over the rows of a file, run once at ingest so that queries never repeat it:
+    pre-open stamps are moved to 09:15, rows sorted, duplicate stamps dropped (the last one is kept) and a flat
+    09:15 bar synthesised for days starting up to OPEN_FILL minutes late.
+    Returns:
+        epoch, ohlc and the quality report, one QUALITY_DTYPE row per day
+    """
+    seconds      = epoch % SECONDS_IN_DAY
+    preopen      = (seconds >= PREOPEN) & (seconds < SESSION_OPEN)
+    epoch        = np.where(preopen, epoch - seconds + SESSION_OPEN, epoch)
+    out_of_order = np.r_[False, epoch[1:] < epoch[:-1]]
+    order        = np.argsort(epoch, kind="stable")
+    epoch, ohlc, preopen, out_of_order = epoch[order], ohlc[order], preopen[order], out_of_order[order]
+    duplicate    = np.r_[epoch[1:] == epoch[:-1], False]
+    keep         = ~duplicate
+    days, rows   = np.unique(epoch // SECONDS_IN_DAY, return_inverse=True)
+    per_day      = lambda flags: np.bincount(rows, weights=flags, minlength=len(days)).astype(np.int32)
+    quality      = np.zeros(len(days), dtype=QUALITY_DTYPE)
+    quality["day"], quality["preopen"] = days, per_day(preopen)
+    quality["duplicates"], quality["out_of_order"] = per_day(duplicate), per_day(out_of_order)
+    epoch, ohlc  = epoch[keep], ohlc[keep]
+    rows         = rows[keep]
+
+    # regular bars end in (09:15, 15:30]
+    seconds      = epoch % SECONDS_IN_DAY
+    regular      = (seconds > SESSION_OPEN) & (seconds <= SESSION_CLOSE)
+    first        = np.full(len(days), np.iinfo(np.int64).max)
+    last         = np.full(len(days), -1)
+    np.minimum.at(first, rows[regular], seconds[regular])
+    np.maximum.at(last, rows[regular], seconds[regular])
+    late         = np.zeros(len(days), dtype=bool)
+    late[rows[seconds > SESSION_CLOSE + LATE_ROWS]] = True
+
+    fill         = (first > SESSION_OPEN + 60) & (first <= SESSION_OPEN + 60 * (OPEN_FILL + 1))
+    if fill.any():
+        stamps    = days[fill] * SECONDS_IN_DAY + SESSION_OPEN + 60
+        positions = np.searchsorted(epoch, stamps)
+        # the pre-open price if the day has one, else the open of the first bar
+        previous  = np.maximum(positions - 1, 0)
+        has_pre   = (positions > 0) & (epoch[previous] == stamps - 60)
+        price     = np.where(has_pre, ohlc[previous, 3], ohlc[positions, 0])
+        epoch     = np.insert(epoch, positions, stamps)
+        ohlc      = np.insert(ohlc, positions, np.repeat(price[:, None], len(COLUMNS), axis=1), axis=0)
+        first[fill] = SESSION_OPEN + 60
+        quality["synthetic_open"] = fill
+
+    bars         = per_day(regular) + fill
+    quality["bars"]         = bars
+    quality["gaps"]         = np.where(last > 0, (last - first) // 60 + 1 - bars, 0)
+    quality["non_standard"] = (first != SESSION_OPEN + 60) | (last != SESSION_CLOSE) | late
+    return epoch, ohlc, quality
+
+def _readManifest(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, MANIFEST), "r") as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return {}
+
+def _tmpPath(path):
+    """ unique temporary name next to path, so concurrent writers never share one """
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{uuid.uuid4().hex[:8]}.tmp{ext}"
+
+def _writeManifest(cache_dir, manifest):
+    path = os.path.join(cache_dir, MANIFEST)
+    tmp  = _tmpPath(path)
+    with open(tmp, "w") as fp:
+        json.dump(manifest, fp, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+_manifest_lock = threading.Lock()
+
+def _updateManifest(cache_dir, entries):
+    """
+    merges entries into the manifest on disk; threads of this process serialise on a lock, a writer in another
+    process may still win the race, which only costs a re-parse later. A failed write is logged, not raised.
+    """
+    with _manifest_lock:
+        try:
+            manifest = _readManifest(cache_dir)
+            manifest.update(entries)
+            _writeManifest(cache_dir, manifest)
+        except OSError as e:
+            logger.warning("could not update the manifest in %s: %s", cache_dir, e)
+
+def _sourceStamp(filename):
+    archive, member = _splitMember(filename)
+    if archive is not None:
+        crc, size = _archiveMembers(archive)[member]
+        return {"crc": crc, "size": size}
+    stat = os.stat(filename)
+    return {"mtime": stat.st_mtime, "size": stat.st_size}
+
+def _cachePaths(cache_dir, filename):
+    stem = os.path.splitext(_sourceName(filename))[0]
+    return tuple(os.path.join(cache_dir, f"{stem}.{name}.npy") for name in ("epoch", "ohlc", "quality"))
+
+def _saveCachedFile(cache_dir, filename, epoch, ohlc, quality):
+    os.makedirs(cache_dir, exist_ok=True)
+    for path, arr in zip(_cachePaths(cache_dir, filename), (epoch, ohlc, quality)):
+        tmp = _tmpPath(path)
+        np.save(tmp, arr)
+        os.replace(tmp, path)
+
+def _loadCachedFile(cache_dir, filename, manifest):
+    """ memory-maps the cached arrays of filename, or None if the cache is missing or stale """
+    entry = manifest.get(_sourceName(filename))
+    if entry is None or entry.get("version") != CACHE_VERSION or entry.get("source") != _sourceStamp(filename):
+        return None
+    try:
+        epoch, ohlc, quality = (np.load(path, mmap_mode="r") for path in _cachePaths(cache_dir, filename))
+    except (OSError, ValueError):
+        return None
+    return entry["ticker"], epoch, ohlc, quality
+
+def _getWorkers(workers=None):
+    workers = WORKERS if workers is None else int(workers)
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+def _parseFiles(files, workers=None):
+    """
+    yields the parsed files in order, parsed in a process pool when there is more than one file and worker.
+    At most 2 * workers files are in flight, so memory stays bounded for any number of files; only numpy arrays come back.
+    """
+    workers = min(_getWorkers(workers), len(files))
+    if workers <= 1:
+        for file in files:
+            with timed("offline.parse"):
+                item = _parseFile(file)
+            yield item
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+
+        def next_():
+            with timed("offline.parse"):
+                return pending.popleft().result()
+
+        for file in files:
+            pending.append(pool.submit(_parseFile, file))
+            if len(pending) >= 2 * workers:
+                yield next_()
+        while pending:
+            yield next_()
+
+def _loadFiles(files, workers=None, keep=True):
+    """
+    loads each file from the columnar cache next to it, (re)ingesting only files that are new or changed.
+    Args:
+        workers (int): processes used to parse the files missing from the cache, see WORKERS
+        keep (bool)  : False only fills the cache, parsed arrays are dropped once stored
+    Returns:
+        list of (ticker, epoch, ohlc, quality) in the order of files, None entries with keep=False
+    """
+    loaded    = [None] * len(files)
+    manifests = {}
+    missing   = []
+    for i, file in enumerate(files):
+        cache_dir = _getCacheDir(file)
+        if cache_dir not in manifests:
+            manifests[cache_dir] = _readManifest(cache_dir)
+        loaded[i] = _loadCachedFile(cache_dir, file, manifests[cache_dir])
+        if loaded[i] is None:
+            missing.append(i)
+        elif not keep:
+            loaded[i] = None
+    count("offline.cache.hit", len(files) - len(missing))
+    count("offline.cache.miss", len(missing))
+
+    updates = {}
+    for i, item in zip(missing, _parseFiles([files[i] for i in missing], workers)):
+        file      = files[i]
+        cache_dir = _getCacheDir(file)
+        loaded[i] = item if keep else None
+        try:
+            _saveCachedFile(cache_dir, file, *item[1:])
+            updates.setdefault(cache_dir, {})[_sourceName(file)] = {
+                "ticker": item[0], "source": _sourceStamp(file), "version": CACHE_VERSION}
+        except OSError as e:
+            logger.warning("could not cache %s: %s", file, e)
+    for cache_dir, entries in updates.items():
+        _updateManifest(cache_dir, entries)
+    return loaded
+
+def _mergeArrays(loaded):
+    """ concatenates per file arrays once and sorts them on epoch """
+    if not loaded:
+        return "", np.empty(0, dtype=np.int64), np.empty((0, len(COLUMNS)), dtype=np.float64)
+    epoch = np.concatenate([item[1] for item in loaded])
+    ohlc  = np.concatenate([item[2] for item in loaded])
+    order = np.argsort(epoch, kind="stable")
+    return loaded[0][0], epoch[order], ohlc[order]
+
+def _arraysToDf(ticker, epoch, ohlc, compact=False):
+    """ compact: COMPACT_DTYPE prices and a categorical ticker instead of float64 and one string per row """
+    if compact:
+        ohlc = ohlc.astype(COMPACT_DTYPE)
+    df = pd.DataFrame(ohlc, columns=COLUMNS, index=pd.DatetimeIndex(epoch.astype("datetime64[s]"), name="date_time"))
+    df.insert(0, "Ticker", pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), [ticker]) if compact else ticker)
     return df
 
 def _addDateAndTimeColumnsFromDateTimeIndex(df):
@@ -35,79 +350,391 @@ def _addDateAndTimeColumnsFromDateTimeIndex(df):
         df["time"]     = df["datetime"].dt.time.astype(str)
         df["date"]     = df["datetime"].dt.date.astype(str)
     except:
-        print ("Error in adding date and time columns")
-        print(df)
+        logger.exception("Error in adding date and time columns")
     return df
 
-def _makeUnifiedDf(filepath=None):
-    df = pd.DataFrame()
-    for file in _getFiles(filepath=filepath):
-        df_tmp  = _getDf(file)
-        df      = pd.concat([df, df_tmp])
-    df = df.set_index("date_time")
-    df = df.sort_index()
+def _makeUnifiedDf(filepath=None, workers=None):
+    df = _arraysToDf(*_mergeArrays(_loadFiles(_getFiles(filepath=filepath), workers)))
     df = _addDateAndTimeColumnsFromDateTimeIndex(df)
     return df
 
-# multi-processing
-def _makeUnifiedDf_MP(filepath=None):
-    df = pd.DataFrame()
-    dfs = []
-    files = _getFiles(filepath=filepath)
-    with Pool(8) as pool:
-        dfs = pool.map(_getDf, files)
-    for item in dfs:
-        df      = df.append(item)
-    df = df.set_index("date_time")
-    df = df.sort_index()
-    df = _addDateAndTimeColumnsFromDateTimeIndex(df)
-    return df
+def _sourceKey(files):
+    """ identifies a set of source files and their versions, used to name persisted bars """
+    stamps = [CACHE_VERSION] + [[_sourceName(file), _sourceStamp(file)] for file in files]
+    return hashlib.md5(json.dumps(stamps, sort_keys=True).encode()).hexdigest()[:16]
 
-def _makePerDayDataFromUnifiedDf(df):
-    dfs = dict(tuple(df.groupby(df["date"])))
-    return dfs
-
-def _addMissing915ToPerDayDf(day_df):
-    first_row = day_df.iloc[0].copy()
-    if "9:16" in str(first_row["time"]):
-        first_row["time"]           = "09:15:00"
-        first_row["datetime"]       = first_row["datetime"].replace(minute=15)
-        day_df.reset_index(drop=True, inplace=True)
-        day_df                      = day_df.append(first_row)
-        day_df["date_time"]         = day_df["datetime"]
-        day_df.set_index("date_time", inplace=True)
-        day_df.sort_index(inplace=True)
-    return day_df
-
-def _groupDataForTimeframe(df, timeframe):
-    return  df.groupby(pd.Grouper(freq='{}Min'.format(timeframe), closed="right", label="right", origin="start")).agg({
-    "Open": "first",
-    "High": "max",
-    "Low": "min",
-    "Close": "last"})
-    
+
+class _Bars:
+    """ bars of one timeframe for the whole history, with its own day index """
+    def __init__(self, epoch, ohlc):
+        self.df        = pd.DataFrame(ohlc, columns=COLUMNS, index=pd.DatetimeIndex(epoch.astype("datetime64[s]"), name="date_time"))
+        self.epoch     = epoch
+        self.day_index = DayIndex(epoch)
+        self.nbytes    = epoch.nbytes + ohlc.nbytes + self.day_index.nbytes()
+
+    def day(self, date):
+        start, end = self.day_index.bounds(date)
+        return self.df.iloc[start:end]
+
+    def range(self, start=None, end=None):
+        return self.df.iloc[slice(*rangeBounds(self.epoch, start, end))]
+
+    def merge(self, epoch, ohlc):
+        """ these bars and the bars of other days, sorted on epoch """
+        epoch = np.concatenate([self.epoch, epoch])
+        ohlc  = np.concatenate([self.df.to_numpy(), ohlc])
+        order = np.argsort(epoch, kind="stable")
+        return _Bars(epoch[order], ohlc[order])
+
+
+class _BarCache:
+    """
+    timeframe -> _Bars of the unified rows (epoch, ohlc), built lazily on first request and kept, least recently
+    used timeframes are evicted once the memory budget is exceeded. With a directory, bars are also persisted
+    as .npy next to the raw cache, named by key; files of other keys are removed least recently used first
+    once all persisted bars exceed the same budget, and the files of a replaced key right away.
+    """
+    def __init__(self, epoch, ohlc, budget=BAR_CACHE_BUDGET, directory=None, key=None, dtype=np.float64):
+        self.epoch      = epoch
+        self.ohlc       = ohlc
+        self.dtype      = dtype
+        self.budget     = budget
+        self.directory  = directory
+        self.key        = key
+        self.bars       = OrderedDict()
+
+    def _paths(self, timeframe):
+        stem = os.path.join(self.directory, f"bars_{self.key}_{timeframe}m{'' if self.dtype == np.float64 else '_' + np.dtype(self.dtype).name}")
+        return stem + ".epoch.npy", stem + ".ohlc.npy"
+
+    def _load(self, timeframe):
+        try:
+            epoch, ohlc = (np.load(path, mmap_mode="r") for path in self._paths(timeframe))
+            for path in self._paths(timeframe):
+                os.utime(path)      # recently used, pruned last
+            return epoch, ohlc
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, timeframe, epoch, ohlc):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            for path, arr in zip(self._paths(timeframe), (epoch, ohlc)):
+                tmp = _tmpPath(path)
+                np.save(tmp, arr)
+                os.replace(tmp, path)
+        except OSError as e:
+            logger.warning("could not persist %sm bars: %s", timeframe, e)
+        self._prune()
+
+    def _persisted(self):
+        """ (mtime, bytes, path) of the persisted bars of all keys in the directory """
+        files = []
+        for path in glob.glob(os.path.join(self.directory, "bars_*.npy")):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _remove(self, paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _prune(self):
+        if self.budget is None:
+            return
+        files = sorted(self._persisted())
+        total = sum(size for _, size, _ in files)
+        own   = f"bars_{self.key}_"
+        for _, size, path in files:
+            if total <= self.budget:
+                break
+            if not os.path.basename(path).startswith(own):
+                self._remove([path])
+                total -= size
+
+    def _resample(self, epoch, ohlc, timeframe):
+        # rows are labelled by the end of the minute, hence move them back by a minute to label them by bar start.
+        # the 09:15 pre-open row then falls before the session and is dropped by the resampler.
+        bins, out = resample(epoch - 60, {name: ohlc[:, i] for i, name in enumerate(COLUMNS)}, timeframe)
+        if not len(bins):
+            return bins, np.empty((0, len(COLUMNS)), dtype=self.dtype)
+        return bins, np.column_stack([out[name] for name in COLUMNS]).astype(self.dtype, copy=False)
+
+    def _build(self, timeframe):
+        return self._resample(self.epoch, self.ohlc, timeframe)
+
+    def extend(self, epoch, ohlc, new_epoch, new_ohlc, key=None, directory=None):
+        """
+        the unified rows became (epoch, ohlc) by adding the rows (new_epoch, new_ohlc) of days not held before.
+        Bins never cross days, so cached timeframes only resample the new rows and merge them in; persisted
+        bars move to the new key.
+        """
+        held = np.unique(self.epoch // SECONDS_IN_DAY)
+        if np.isin(np.unique(new_epoch // SECONDS_IN_DAY), held).any():
+            self.bars.clear()       # the new rows add to days already binned, rebuild on demand
+        for timeframe, bars in self.bars.items():
+            self.bars[timeframe] = bars.merge(*self._resample(new_epoch, new_ohlc, timeframe))
+        if self.directory and self.key is not None and self.key != key:
+            self._remove(path for _, _, path in self._persisted()
+                         if os.path.basename(path).startswith(f"bars_{self.key}_"))
+        self.epoch, self.ohlc, self.key = epoch, ohlc, key
+        self.directory = directory or self.directory
+        self._evict()
+        if self.directory:
+            for timeframe, bars in self.bars.items():
+                self._save(timeframe, bars.epoch, bars.df.to_numpy())
+
+    def _evict(self):
+        if self.budget is None:
+            return
+        while len(self.bars) > 1 and sum(bars.nbytes for bars in self.bars.values()) > self.budget:
+            self.bars.popitem(last=False)
+
+    def get(self, timeframe) -> _Bars:
+        timeframe = int(timeframe)
+        if timeframe in self.bars:
+            count("offline.bars.hit")
+            self.bars.move_to_end(timeframe)
+            return self.bars[timeframe]
+        count("offline.bars.miss")
+        arrays = self._load(timeframe) if self.directory else None
+        if arrays is None:
+            arrays = self._build(timeframe)
+            if self.directory:
+                self._save(timeframe, *arrays)
+        self.bars[timeframe] = _Bars(*arrays)
+        self._evict()
+        return self.bars[timeframe]
+
+    def timeframes(self):
+        return list(self.bars.keys())
 
 
 ## Public Apis ## 
+def ingest(filepath=None, workers=0, ticker="BNF"):
+    """
+    converts the text files and the members of the zipped archives (ARCHIVES) into the columnar cache (data/.cache) once.
+    Only files whose mtime/size (members: crc/size) changed since the last ingest are parsed again, by workers
+    processes, all cpus by default. Parsed files are stored and dropped one by one, memory does not grow with history.
+    Returns:
+        list[str]: files covered by the cache
+    """
+    files = _getFiles(ticker=ticker, filepath=filepath)
+    _loadFiles(files, workers, keep=False)
+    return files
+
 class BnfOfflineDataSource:
-    def __init__(self, filepath=None):
-        self.unified_df = _makeUnifiedDf(filepath=filepath)
-        self.dfs        = _makePerDayDataFromUnifiedDf(self.unified_df)
-        self.dates      = list(self.dfs.keys())
+    """
+    Args:
+        filepath (str)       : glob of the text files, defaults to data/*{ticker}.txt
+        ticker (str)         : BNF or NIFTY, used when filepath is not given
+        bar_cache_budget(int): bytes of resampled bars kept in memory, None for no limit
+        persist_bars (bool)  : also store resampled bars as .npy in the cache directory
+        start, end (str)     : only load the monthly files overlapping this range, "YYYY-MM-DD".
+                               other months are loaded when getDayData asks for one of their dates.
+        workers (int)        : processes parsing files missing from the cache, defaults to WORKERS
+        compact (bool)       : hold prices as COMPACT_DTYPE and the ticker as a category, without the per row
+                               datetime/date/time columns; addDateAndTime() derives them for a frame when needed.
+                               see memoryReport()
+    """
+    def __init__(self, filepath=None, bar_cache_budget=BAR_CACHE_BUDGET, persist_bars=False, start=None, end=None,
+                 workers=None, compact=False, ticker="BNF"):
+        self.files            = _getFiles(ticker=ticker, filepath=filepath)
+        self.file_months      = {file: _getMonthOfFile(file) for file in self.files}
+        self.bar_cache_budget = bar_cache_budget
+        self.persist_bars     = persist_bars
+        self.workers          = workers
+        self.compact          = compact
+        self.loaded           = OrderedDict()
+        self.bar_cache        = None
+        self._load(_filterFilesByRange(self.files, start, end))
+
+    def _load(self, files):
+        """ adds files to the loaded data and rebuilds the unified frame, day index and bar cache """
+        files = [file for file in files if file not in self.loaded]
+        if not files and self.loaded:
+            return
+        items = _loadFiles(files, self.workers)
+        for file, item in zip(files, items):
+            self.loaded[file] = item
+        loaded               = list(self.loaded.keys())
+        ticker, epoch, ohlc  = _mergeArrays(items)
+        ohlc                 = ohlc.astype(COMPACT_DTYPE if self.compact else np.float64, copy=False)
+        directory            = _getCacheDir(loaded[0]) if (self.persist_bars and loaded) else None
+        key                  = _sourceKey(loaded) if directory else None
+        if self.bar_cache is None:
+            self.ticker     = ticker
+            self.epoch      = epoch
+            self.ohlc       = ohlc
+            self.bar_cache  = _BarCache(epoch, ohlc, budget=self.bar_cache_budget, directory=directory, key=key,
+                                        dtype=COMPACT_DTYPE if self.compact else np.float64)
+        else:
+            # add the new months to the held rows and cached bars instead of rebuilding them from all months
+            new_epoch, new_ohlc = epoch, ohlc
+            self.ticker = self.ticker or ticker     # the first range may have matched no files
+            epoch      = np.concatenate([self.epoch, new_epoch])
+            order      = np.argsort(epoch, kind="stable")
+            self.epoch = epoch[order]
+            self.ohlc  = np.concatenate([self.ohlc, new_ohlc])[order]
+            self.bar_cache.extend(self.epoch, self.ohlc, new_epoch, new_ohlc, key, directory)
+        self.day_index   = DayIndex(self.epoch)
+        self._unified_df = None
+
+    @property
+    def unified_df(self) -> pd.DataFrame:
+        """ all held rows as one frame, built on first use after a load """
+        if self._unified_df is None:
+            df = _arraysToDf(self.ticker, self.epoch, self.ohlc, compact=self.compact)
+            self._unified_df = df if self.compact else _addDateAndTimeColumnsFromDateTimeIndex(df)
+        return self._unified_df
+
+    def _ensureDate(self, date):
+        """ loads the monthly file of date if it is not loaded yet """
+        if date in self.day_index:
+            return
+        month = _getMonthOfDate(date)
+        self._load([file for file, file_month in self.file_months.items() if file_month == month])
+
+    def loadRange(self, start=None, end=None):
+        """ loads the monthly files overlapping [start, end] in addition to the ones already loaded """
+        self._load(_filterFilesByRange(self.files, start, end))
     
     def getCompleteData(self)->pd.DataFrame:
         return self.unified_df
     
     def getDayData(self, date, timeframe=1):
-        # each day data is shifted by 1 min or 1 tf to be correct, hence shift it by -1.
-        if int(timeframe) == 1:
-            df = _addMissing915ToPerDayDf(self.dfs[date]).shift(-1).dropna()  
-        else:
-            day_df = _addMissing915ToPerDayDf(self.dfs[date])
-            df = _groupDataForTimeframe(day_df, timeframe=int(timeframe)).shift(-1).dropna()
-        if "09:15:00" not in str(df.index[0]):
-            print("This DF should be discarded: {}".format(str(df.index[0])))
-        return df
+        """ bars of date; days not starting at 09:15 or otherwise irregular are flagged in getQualityReport() """
+        self._ensureDate(date)
+        return self.bar_cache.get(timeframe).day(date)
+
+    def getQualityReport(self) -> pd.DataFrame:
+        """
+        one row per loaded day, built at ingest: regular bars, pre-open rows moved to 09:15, whether the 09:15 bar
+        is synthetic, duplicate and out of order rows, missing minutes between the first and last bar and
+        non_standard for days not running 09:15 - 15:30 (late start, early close, special sessions).
+        """
+        quality = [item[3] for item in self.loaded.values()]
+        report  = pd.DataFrame(np.concatenate(quality) if quality else np.empty(0, dtype=QUALITY_DTYPE))
+        report.index = pd.Index(report.pop("day").to_numpy().astype("datetime64[D]").astype(str), name="date")
+        return report.sort_index()
+
+    def getRange(self, start=None, end=None, timeframe=1) -> pd.DataFrame:
+        """
+        bars of timeframe within [start, end], both inclusive, e.g. ("2022-01-06 14:00", "2022-01-06 15:29") or
+        ("2022-01-03", "2022-01-07"); a date without a time as end covers the whole day. Months not loaded yet are
+        loaded, the bars are a slice of the cached ones found by binary search.
+        """
+        self.loadRange(start, end)
+        return self.bar_cache.get(timeframe).range(start, end)
+
+    def getTimeframeData(self, timeframe=1) -> pd.DataFrame:
+        """ bars of timeframe for the whole history, built once and cached """
+        return self.bar_cache.get(timeframe).df
+
+    def iterDays(self, start=None, end=None, timeframe=1, prefetch_files=2):
+        """
+        yields (date, bars) for [start, end] in chronological order, one monthly file at a time.
+        Files are read and resampled on a background thread, prefetch_files ahead of the consumer.
+        Independent of the loaded months, so memory stays bounded by a few files for any range.
+        """
+        def bars():
+            for file in _sortFilesByMonth(_filterFilesByRange(self.files, start, end)):
+                df = _arraysToDf(*_mergeArrays(_loadFiles([file])))
+                yield resampleDf(df, int(timeframe), epoch=wallEpochFromIndex(df.index) - 60)
+
+        for df in prefetch(bars(), depth=prefetch_files):
+            yield from iterDayFrames(df, start, end)
+
+    @staticmethod
+    def addDateAndTime(df) -> pd.DataFrame:
+        """ copy of df with the datetime, time and date columns of a non compact source """
+        return _addDateAndTimeColumnsFromDateTimeIndex(df.copy())
+
+    def memoryReport(self) -> dict:
+        """ bytes held by the unified frame (per column), the day index and the cached bars (per timeframe) """
+        columns = self.unified_df.memory_usage(index=True, deep=True)
+        bars    = {f"{timeframe}m": self.bar_cache.bars[timeframe].nbytes for timeframe in self.bar_cache.timeframes()}
+        report  = {
+            "compact"   : self.compact,
+            "rows"      : len(self.unified_df),
+            "unified_df": {name: int(nbytes) for name, nbytes in columns.items()},
+            "day_index" : self.day_index.nbytes(),
+            "bars"      : bars,
+        }
+        report["total"] = int(columns.sum()) + report["day_index"] + sum(bars.values())
+        return report
 
     def getDates(self):
-        return self.dates
\ No newline at end of file
+        """ dates of the loaded months """
+        return self.day_index.dates()
+
+
+class OfflinePanel:
+    """
+    several tickers on one time axis, for cross ticker studies (spreads, relative strength) as array operations.
+        epoch (n,)         : wall-clock bar start epochs, union of the bars of all tickers
+        ohlc  (k, n, 4)    : Open, High, Low, Close per ticker, NaN where the ticker has no bar
+        mask  (k, n)       : True where the ticker has a bar
+    Bars are the ones getDayData returns: labelled by bar start, pre-open rows left out, resampled to timeframe.
+    Args:
+        tickers (list)     : file suffixes, data/*{ticker}.txt
+        filepath (str)     : glob with a {ticker} placeholder, defaults to data/*{ticker}.txt
+        start, end (str)   : only load the monthly files overlapping this range, "YYYY-MM-DD"
+    """
+    def __init__(self, tickers=("BNF", "NIFTY"), timeframe=1, start=None, end=None, filepath=None, workers=None,
+                 dtype=np.float64):
+        self.tickers   = list(tickers)
+        self.timeframe = int(timeframe)
+        bars           = [self._loadTicker(ticker, filepath, start, end, workers) for ticker in self.tickers]
+        self.epoch     = np.unique(np.concatenate([epoch for epoch, _ in bars])) if bars else np.empty(0, dtype=np.int64)
+        self.ohlc      = np.full((len(self.tickers), len(self.epoch), len(COLUMNS)), np.nan, dtype=dtype)
+        self.mask      = np.zeros((len(self.tickers), len(self.epoch)), dtype=bool)
+        for i, (epoch, ohlc) in enumerate(bars):
+            positions               = np.searchsorted(self.epoch, epoch)
+            self.ohlc[i, positions] = ohlc
+            self.mask[i, positions] = True
+        self.day_index = DayIndex(self.epoch)
+
+    def _loadTicker(self, ticker, filepath, start, end, workers):
+        files = _filterFilesByRange(_getFiles(ticker=ticker, filepath=filepath.format(ticker=ticker) if filepath else None),
+                                    start, end)
+        _, epoch, ohlc = _mergeArrays(_loadFiles(files, workers))
+        # labelled by bar end in the files, see _BarCache._build; resampling also folds duplicate stamps into one bar
+        bins, out = resample(epoch - 60, {name: ohlc[:, i] for i, name in enumerate(COLUMNS)}, self.timeframe)
+        return bins, np.column_stack([out[name] for name in COLUMNS]) if len(bins) else np.empty((0, len(COLUMNS)))
+
+    def index(self) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(self.epoch.astype("datetime64[s]"), name="date_time")
+
+    def column(self, name) -> np.ndarray:
+        """ (k, n) view of one of Open, High, Low, Close """
+        return self.ohlc[:, :, COLUMNS.index(name)]
+
+    def ticker(self, ticker) -> np.ndarray:
+        """ (n, 4) view of the bars of one ticker """
+        return self.ohlc[self.tickers.index(ticker)]
+
+    def complete(self) -> np.ndarray:
+        """ (n,) True where every ticker has a bar """
+        return self.mask.all(axis=0)
+
+    def day(self, date) -> slice:
+        """ positions of date on the time axis, raises KeyError when no ticker has data for date """
+        return slice(*self.day_index.bounds(date))
+
+    def range(self, start=None, end=None) -> slice:
+        """ positions of [start, end] on the time axis, see BnfOfflineDataSource.getRange """
+        return slice(*rangeBounds(self.epoch, start, end))
+
+    def dates(self):
+        return self.day_index.dates()
+
+    def df(self, ticker) -> pd.DataFrame:
+        """ one ticker on the shared axis, NaN rows where it has no bar """
+        return pd.DataFrame(self.ticker(ticker), columns=COLUMNS, index=self.index())
@@ -1,11 +1,29 @@
 
 import os
+import json
+import uuid
+import bisect
+import pickle
+import re
 import math, time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
 import requests
-import  requests_cache
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup as bs
+import numpy as np
 import pandas as pd
-import dill as pickle
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    from .ohlc_common import resampleDf, prefetch, iterDayFrames, DayMap, daySlice, rangeSlice, LiveBars, OHLCV, SESSION_OPEN, logger, count, timed
+except ImportError:
+    from ohlc_common import resampleDf, prefetch, iterDayFrames, DayMap, daySlice, rangeSlice, LiveBars, OHLCV, SESSION_OPEN, logger, count, timed
 
 
 
@@ -50,36 +68,109 @@ class Helper:
     logging            = True
     datetime_format    = "%Y-%m-%d %H:%M"
     
+    # messages go to the "ohlc" logger at INFO, logging = False drops them before formatting.
     @staticmethod
     def log(string):
         if Helper.logging:
-            print(string)
+            logger.info(string)
     
     
+    # http: one pooled keep-alive session per host, shared by all threads.
+    http_pool_size      = 16
+    http_retries        = 3
+    http_backoff        = 0.5        # seconds, doubled on every retry, with full jitter
+    http_backoff_max    = 30
+    http_retry_statuses = (429, 500, 502, 503, 504)
+    _sessions           = {}
+    _sessions_lock      = threading.Lock()
+    # per datasource limits of every request, so also of bulk() and the windows of each of its symbols:
+    # requests in flight and requests started per second (bursts up to the requests in flight)
+    concurrency         = {"MC": 4, "ET": 4, "Upstox": 2}
+    rate_limit          = {"MC": 4.0, "ET": 4.0, "Upstox": 2.0}
+    _limits             = {}
+    _limits_lock        = threading.Lock()
+
+    @staticmethod
+    def getSession(url: str) -> requests.Session:
+        host = urlparse(url).netloc
+        with Helper._sessions_lock:
+            session = Helper._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=Helper.http_pool_size)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                Helper._sessions[host] = session
+            return session
+
+    @staticmethod
+    def getLimits(datasource):
+        """ (semaphore, RateLimiter) shared by all requests to datasource """
+        with Helper._limits_lock:
+            if datasource not in Helper._limits:
+                concurrency = Helper.concurrency.get(datasource, 1)
+                Helper._limits[datasource] = (threading.BoundedSemaphore(concurrency),
+                                              RateLimiter(Helper.rate_limit.get(datasource, 1.0), burst=concurrency))
+            return Helper._limits[datasource]
+
+    @staticmethod
+    def retryDelay(attempt, retry_after=None):
+        """ seconds to wait before retry number attempt (0 based); Retry-After of the server wins when given """
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0), Helper.http_backoff_max)
+        return random.uniform(0, min(Helper.http_backoff_max, Helper.http_backoff * (2 ** attempt)))
+
     @staticmethod
-    def getUrl(url: str, headers=None, timeout=20):
+    def getUrl(url: str, headers=None, timeout=20, datasource=None):
+        """
+        GET with a pooled session; 429/5xx/timeouts/connection errors are retried with backoff.
+        With a datasource every attempt waits for its limits, see Helper.concurrency and Helper.rate_limit.
+        """
         Helper.log(f"getting url: {url}")
-        try:
-            if not headers:
-                res = requests.get(url, timeout=timeout)
-            else:
-                res = requests.get(url, headers=headers, timeout=timeout)
+        session = Helper.getSession(url)
+        host    = urlparse(url).netloc
+        limits  = Helper.getLimits(datasource) if datasource else None
+        for attempt in range(Helper.http_retries + 1):
+            last = attempt == Helper.http_retries
+            try:
+                if limits:
+                    with limits[0]:
+                        limits[1].acquire()
+                        with timed(f"http.{host}"):
+                            res = session.get(url, headers=headers or None, timeout=timeout)
+                else:
+                    with timed(f"http.{host}"):
+                        res = session.get(url, headers=headers or None, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                count(f"http.{host}.errors")
+                if last:
+                    raise DownloadFailedException() from e
+                Helper.log(f"retrying {url}: {e}")
+                count(f"http.{host}.retries")
+                time.sleep(Helper.retryDelay(attempt))
+                continue
+            except requests.RequestException as e:
+                count(f"http.{host}.errors")
+                raise DownloadFailedException() from e
+            count(f"http.{host}.bytes", len(res.content))
             if res.status_code == 200:
                 return res
-            raise RequestingParamException() # other status codes.
-        except:
-            raise DownloadFailedException()
-    
-    @staticmethod
-    def getCachedUrl(url):
-        session = requests_cache.CachedSession('mc_index_cache')
-        return session.get(url)
+            count(f"http.{host}.status.{res.status_code}")
+            if res.status_code in Helper.http_retry_statuses and not last:
+                Helper.log(f"retrying {url}: status {res.status_code}")
+                count(f"http.{host}.retries")
+                time.sleep(Helper.retryDelay(attempt, res.headers.get("Retry-After")))
+                continue
+            raise DownloadFailedException() # other status codes.
     
-    @staticmethod
-    def getCachedSoup(url: str):
-        res = Helper.getCachedUrl(url)
-        return bs(res.text, 'html.parser')
-
     @staticmethod
     def officialNamesOfIndex(name: str):
         if name.upper() == "BANKNIFTY" or name.lower() == "banknifty":
@@ -90,30 +181,52 @@ class Helper:
             return "NIFTY MIDCAP 50"
         return name 
     
+    @staticmethod
+    def parseJson(res):
+        """ response body -> python objects, with orjson when it is installed """
+        if orjson is not None:
+            return orjson.loads(res.content)
+        return res.json()
+
     @staticmethod
     def jsonTypeAtoDf(jsons, input_cols=["t", "o", "h", "l", "c", "v"]):
         """ 
         input = {    s: ok, t: [], o: [], h: [], l: [], c: [], v: [] }
         t: should be in epochs
+        the lists (or arrays) become typed numpy columns directly, rows with missing values are dropped.
         """
         try:
-            df              = pd.DataFrame(list(zip(jsons[input_cols[0]], jsons[input_cols[1]], jsons[input_cols[2]], jsons[input_cols[3]], jsons[input_cols[4]], jsons[input_cols[5]])), 
-                                        columns=Helper.default_df_columns)
-            df["date"]      = pd.to_datetime(df["epoch"], unit="s") + pd.Timedelta("05:30:00")
-            df["date_time"] = df["date"]
-            df              = df.set_index("date_time")
-            return df.dropna()
-        except:
-            raise DataFormatException()
+            with timed("decode.jsonTypeA"):
+                epoch  = np.asarray(jsons[input_cols[0]], dtype=np.float64)
+                values = np.column_stack([np.asarray(jsons[col], dtype=np.float64) for col in input_cols[1:]]) \
+                         if len(epoch) else np.empty((0, len(input_cols) - 1))
+                valid  = ~(np.isnan(epoch) | np.isnan(values).any(axis=1))
+                if not valid.all():
+                    epoch, values = epoch[valid], values[valid]
+                epoch  = epoch.astype(np.int64)
+                date   = (epoch + 19800).astype("datetime64[s]")    # IST
+                df     = pd.DataFrame(values, columns=Helper.default_df_columns[1:],
+                                      index=pd.DatetimeIndex(date, name="date_time"))
+                df.insert(0, Helper.default_df_columns[0], epoch)
+                df["date"] = date
+                return df
+        except Exception as e:
+            raise DataFormatException() from e
     
     @staticmethod
     def listOfListsToDf(lol, input_cols=["Time", "Open", "High", "Low", "Close", "Volume", "OI"]):
         """ dataformat: [[time, o, h, l, c, v, oi], [], []]"""
-        df              = pd.DataFrame(lol, columns = input_cols)
-        df["date_time"] = pd.to_datetime(df["Time"]).dt.tz_localize(None)
-        df              = df.set_index("date_time")
-        df.sort_values(by="date_time" , inplace=True)
-        return df
+        with timed("decode.listOfLists"):
+            df              = pd.DataFrame(lol, columns = input_cols)
+            df["date_time"] = pd.to_datetime(df["Time"]).dt.tz_localize(None)
+            df              = df.set_index("date_time")
+            df.sort_values(by="date_time" , inplace=True)
+            return df
+
+    @staticmethod
+    def normaliseDf(df: pd.DataFrame) -> pd.DataFrame:
+        """ Open, High, Low, Close, Volume columns only, whatever the source added (epoch, Time, OI, ...) """
+        return df[[name for name in OHLCV if name in df.columns]]
 
     @staticmethod    
     def groupDataForTimeframe(df: pd.DataFrame, timeframe: int) -> pd.DataFrame:
@@ -149,6 +262,55 @@ class Helper:
         return datetime.strftime(modified_date, "%Y-%m-%d")
     
     
+    @staticmethod
+    def splitDateRange(start, end, days):
+        """ [start, end] -> consecutive [(start, end), ...] windows of at most days calendar days, as "%Y-%m-%d" """
+        windows = []
+        while start <= end:
+            window_end = min(Helper.incrementDateInString(start, days - 1), end)
+            windows.append((start, window_end))
+            start = Helper.incrementDateInString(window_end, 1)
+        return windows
+
+    @staticmethod
+    def mergeJsonTypeA(jsons, input_cols=["t", "o", "h", "l", "c", "v"]) -> dict:
+        """ merges {s, t, o, h, l, c, v} responses into one, sorted and deduplicated on t (first one wins) """
+        merged = {col: np.concatenate([np.asarray(json[col]) for json in jsons]) for col in input_cols}
+        _, first = np.unique(merged[input_cols[0]], return_index=True)
+        return {"s": "ok", **{col: merged[col][first] for col in input_cols}}
+
+    @staticmethod
+    def downloadInWindows(download, start, end, window_days, workers=4, retries=1) -> dict:
+        """
+        splits [start, end] into windows of window_days, calls download(window_start, window_end) for them
+        concurrently and merges the {t, o, h, l, c, v} results on epoch.
+        A failed window is retried alone; windows without data (holidays, future) are skipped.
+        """
+        windows = Helper.splitDateRange(start, end, window_days)
+
+        def fetch(window):
+            for attempt in range(retries + 1):
+                try:
+                    return download(*window)
+                except DateRangeException:
+                    return None
+                except (DownloadFailedException, DownloadedDataException):
+                    if attempt == retries:
+                        raise
+                    Helper.log(f"retrying window {window}")
+
+        if len(windows) == 1:
+            jsons = [fetch(windows[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=max(1, min(workers, len(windows)))) as pool:
+                jsons = list(pool.map(fetch, windows))
+        jsons = [json for json in jsons if json is not None]
+        if not jsons:
+            raise DateRangeException()
+        if len(jsons) == 1:
+            return jsons[0]
+        return Helper.mergeJsonTypeA(jsons)
+
     @staticmethod
     def removeRowsAfterDate(df: pd.DataFrame, date):
         """
@@ -163,64 +325,48 @@ class Helper:
         
     
     # critical dataframe information
-    # check the data, how it behaves.
-    # grouping directly here does something like this: example 3 min,
+    # grouping with pd.Grouper does something like this: example 3 min,
     # 9:15 data remains same, 9:18 -> [9:16, 9:17, 9:18]
     # but it should have been: 9:15 -> [9:15, 9:16, 9:17]
-    # so, shift it down by one and fill it with zero and once grouped, again shift it left:
+    # ohlc_common.resampleDf bins on epochs anchored at 9:15 of each day, same as the offline data source.
     @staticmethod
     def getGroupedDf(df, tf):
-        if tf == 1:
+        if int(tf) == 1:
             return df
-        fixed_df = df.shift(1).fillna(0)
-        final_df = Helper.groupDataForTimeframe(fixed_df, int(tf)).shift(-1).dropna()
-        return final_df
+        return resampleDf(df, int(tf))
     
     # splits a complete dataframe into per day basis
     # return dict [date] = dataframe    
     @staticmethod
-    def mapDfToPerDay(df: pd.DataFrame) -> dict[str, pd.DataFrame]:
+    def mapDfToPerDay(df: pd.DataFrame) -> DayMap:
         """ 
         convert yearly data into per day data.
         Much more efficient than downloading each day data, everytime
+        Day boundaries are found once by binary search on the epochs, each day is a slice made on access.
+        Data before 9:15 of a day is left out.
         Returns:
-            date_df_map (dict_) : key:: date, val:: dataframe
+            date_df_map (DayMap) : key:: date, val:: dataframe
         """
-        date_df_map          = {}
-        df["tmp"]            = df.index
-        df[["date", "time"]] = df["tmp"].astype(str).str.split(expand=True)
-        df_1                 = df.groupby(["date"])
-        for date in df_1.groups:
-            new_df = df_1.get_group(date)
-            # for some unknown reason, for given tf, example 5,
-            # data starts from 9:10
-            # this 9:10 data is basically yesterday's last data.
-            # drop first row:
-            time_row1 = str(list(new_df.index)[0])
-            if "9:15" not in time_row1:
-                new_df = new_df.iloc[1:]
-            date_df_map[date] = new_df
-        return date_df_map
-    
-    @staticmethod
-    def genPath(symbol, start, end):
-        return f"{symbol}_{start}_{end}.pkl"
+        return DayMap(df, SESSION_OPEN)
 
     @staticmethod
-    def save(path, data):
-        with open(path, 'wb') as fp:
-            pickle.dump(data, fp)
+    def dfForDate(df: pd.DataFrame, date) -> pd.DataFrame:
+        """ one day of df (from 9:15), without splitting the rest; raises KeyError when there is no data for date """
+        day_df = daySlice(df, date, SESSION_OPEN)
+        if len(day_df) == 0:
+            raise KeyError(date)
+        return day_df
 
+    @staticmethod
+    def dfForRange(df: pd.DataFrame, start=None, end=None) -> pd.DataFrame:
+        """ rows of df within [start, end] (dates or date times, both inclusive), by binary search on the index """
+        return rangeSlice(df, start, end)
+    
     @staticmethod
     def saveTxt(path, data):
         with open(path, 'a+') as fp:
             fp.write(data)
 
-    @staticmethod
-    def load(path):
-        with open(path, "rb") as fp:
-            return pickle.load(fp)
-
     @staticmethod
     def getEpochFromDateTime(date, time_):
         return math.trunc(time.mktime(time.strptime(f"{date} {time_}", Helper.datetime_format)))
@@ -251,31 +397,260 @@ class Helper:
     
 
 
+class RateLimiter:
+    """ token bucket, thread-safe: at most rate acquisitions per second, bursts up to burst """
+    def __init__(self, rate, burst=1):
+        self.rate   = float(rate)
+        self.burst  = float(burst)
+        self.tokens = float(burst)
+        self.last   = time.monotonic()
+        self.lock   = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now         = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+                self.last   = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class OHLCStore:
+    """
+    1 minute bars of one symbol from one source, keyed by epoch, with the days already downloaded.
+    Files in {directory}/{source}/:
+        {symbol}.json        : held days and the name of the current data file
+        {symbol}.{id}.npy    : bars as one structured array (t int64, o h l c v float64), memory-mapped on read
+    Writes go to a new data file and then atomically replace the json, so parallel workers sharing the
+    directory always read a consistent pair. Days are kept as [first, last] day numbers
+    (days since 1970-01-01, local calendar), inclusive.
+    The directory is bounded by max_bytes, least recently used symbols are evicted first, and today's bars
+    are downloaded again once they are older than today_ttl seconds. Bytes held are walked once per process and
+    then kept as a running total by the writes, the directory is only walked again when the total exceeds max_bytes.
+    """
+    directory = "ohlc_store"
+    max_bytes = 1024 ** 3
+    today_ttl = 60
+    columns   = ["o", "h", "l", "c", "v"]
+    dtype     = np.dtype([("t", np.int64)] + [(col, np.float64) for col in columns])
+    _sizes      = {}        # directory -> bytes held
+    _sizes_lock = threading.Lock()
+
+    def __init__(self, source, symbol, directory=None):
+        self.directory = directory or OHLCStore.directory
+        self.path      = os.path.join(self.directory, source, symbol)
+        self.bars      = np.empty(0, dtype=OHLCStore.dtype)
+        self.intervals = []
+        self.fetched   = 0      # time today's bars were downloaded
+        self.data      = None   # id of the current data file
+        self._read()
+
+    @staticmethod
+    def dayOfDate(date) -> int:
+        return int(np.datetime64(date, "D").astype(np.int64))
+
+    @staticmethod
+    def dateOfDay(day) -> str:
+        return str(np.datetime64(int(day), "D"))
+
+    @staticmethod
+    def today() -> int:
+        return OHLCStore.dayOfDate(time.strftime("%Y-%m-%d"))
+
+    def _read(self):
+        try:
+            with open(self.path + ".json", "r") as fp:
+                meta = json.load(fp)
+            self.bars      = np.load(f"{self.path}.{meta['data']}.npy", mmap_mode="r")
+            self.intervals = [tuple(interval) for interval in meta["intervals"]]
+            self.fetched   = meta.get("fetched", 0)
+            self.data      = meta["data"]
+            os.utime(self.path + ".json")       # recently used, for eviction
+        except (OSError, ValueError, KeyError):
+            self.bars      = np.empty(0, dtype=OHLCStore.dtype)
+            self.intervals = []
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        data = uuid.uuid4().hex[:12]
+        np.save(f"{self.path}.{data}.npy", np.ascontiguousarray(self.bars))
+        tmp  = f"{self.path}.{data}.json"
+        with open(tmp, "w") as fp:
+            json.dump({"intervals": self.intervals, "data": data, "fetched": self.fetched}, fp)
+        os.replace(tmp, self.path + ".json")
+        delta = os.path.getsize(f"{self.path}.{data}.npy")
+        if self.data is not None and self.data != data:
+            try:
+                old    = f"{self.path}.{self.data}.npy"
+                size   = os.path.getsize(old)
+                os.remove(old)
+                delta -= size
+            except OSError:
+                pass        # left for evict() to collect
+        self.data = data
+        OHLCStore._account(self.directory, delta, keep=self.path)
+
+    @staticmethod
+    def _scan(directory) -> dict:
+        """ symbol path -> [mtime of its json (0 for orphaned files), bytes, file paths], in one pass """
+        entries = {}
+        for root, _, names in os.walk(directory):
+            for name in names:
+                file = os.path.join(root, name)
+                try:
+                    stat = os.stat(file)
+                except OSError:
+                    continue
+                entry = entries.setdefault(os.path.join(root, name.partition(".")[0]), [0.0, 0, []])
+                entry[1] += stat.st_size
+                entry[2].append(file)
+                if name.endswith(".json") and name.count(".") == 1:
+                    entry[0] = stat.st_mtime
+        return entries
+
+    @staticmethod
+    def _account(directory, delta, keep=None):
+        """ adds delta bytes to the running total of directory and evicts once it exceeds max_bytes """
+        with OHLCStore._sizes_lock:
+            total = OHLCStore._sizes.get(directory)
+            if total is not None:
+                total = OHLCStore._sizes[directory] = total + delta
+        if total is None:
+            total = sum(entry[1] for entry in OHLCStore._scan(directory).values())
+            with OHLCStore._sizes_lock:
+                OHLCStore._sizes[directory] = total
+        if total > OHLCStore.max_bytes:
+            OHLCStore.evict(directory, keep)
+
+    @staticmethod
+    def evict(directory=None, keep=None):
+        """ removes least recently used symbols (and orphaned data files) until the directory is below max_bytes """
+        directory = directory or OHLCStore.directory
+        entries   = OHLCStore._scan(directory)
+        total     = sum(entry[1] for entry in entries.values())
+        for path, (_, size, files) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if total <= OHLCStore.max_bytes:
+                break
+            if path == keep:
+                continue
+            for file in files:
+                try:
+                    os.remove(file)
+                except OSError:
+                    pass
+            total -= size
+        with OHLCStore._sizes_lock:
+            OHLCStore._sizes[directory] = total
+
+    def missing(self, start, end) -> list:
+        """ [(start, end), ...] date ranges of [start, end] that are not held yet (or hold a stale today) """
+        today     = OHLCStore.today()
+        intervals = self.intervals
+        if time.time() - self.fetched > OHLCStore.today_ttl:
+            intervals = [(a, min(b, today - 1)) for a, b in intervals if a <= today - 1]
+        gaps  = []
+        first = OHLCStore.dayOfDate(start)
+        last  = OHLCStore.dayOfDate(end)
+        for held_first, held_last in intervals:
+            if held_last < first or held_first > last:
+                continue
+            if held_first > first:
+                gaps.append((first, held_first - 1))
+            first = max(first, held_last + 1)
+        if first <= last:
+            gaps.append((first, last))
+        return [(OHLCStore.dateOfDay(a), OHLCStore.dateOfDay(b)) for a, b in gaps]
+
+    def add(self, data, start, end, write=True):
+        """
+        merges a {t, o, h, l, c, v} download (newer bars win) and marks [start, end] as held, up to today.
+        write=False leaves the files to a later save(), for adding several downloads with one write.
+        """
+        if data is not None and len(data["t"]):
+            new      = np.empty(len(data["t"]), dtype=OHLCStore.dtype)
+            new["t"] = np.asarray(data["t"], dtype=np.int64)
+            for col in OHLCStore.columns:
+                new[col] = np.asarray(data[col], dtype=np.float64)
+            bars      = np.concatenate([new, self.bars])
+            _, first  = np.unique(bars["t"], return_index=True)
+            self.bars = bars[first]
+        first = OHLCStore.dayOfDate(start)
+        last  = min(OHLCStore.dayOfDate(end), OHLCStore.today())
+        if last == OHLCStore.today():
+            self.fetched = time.time()
+        if first <= last:
+            intervals = sorted(self.intervals + [(first, last)])
+            merged    = [intervals[0]]
+            for a, b in intervals[1:]:
+                if a <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+                else:
+                    merged.append((a, b))
+            self.intervals = merged
+        if write:
+            self._write()
+
+    def save(self):
+        self._write()
+
+    def get(self, start, end) -> dict:
+        """ held bars of the days [start, end] as {s, t, o, h, l, c, v} """
+        t  = self.bars["t"]
+        lo = np.searchsorted(t, Helper.getEpochFromDateTime(start, "0:00"), side="left")
+        hi = np.searchsorted(t, Helper.getEpochFromDateTime(end, "23:59") + 59, side="right")
+        return {"s": "ok", "t": t[lo:hi], **{col: self.bars[col][lo:hi] for col in OHLCStore.columns}}
+
+
 class Downloader:
+    """
+    cached=True reads the symbol's OHLCStore, downloads only the days it does not hold yet and adds them to
+    the store with one write; otherwise the whole range is downloaded and the store is not touched.
+    """
     def __init__(self, symbol, start, end, cached=False):
         self.symbol = symbol
         self.start  = start
         self.end    = end
         self.cached = cached
-        self.path   = Helper.genPath(symbol, start, end)
+        self.store  = OHLCStore(type(self).__name__, symbol) if cached else None
+        self._df1   = None
         self._initData()
-        
-    def _loadData(self):
-        self.data = Helper.load(self.path)
-    
-    def _saveData(self):
-        Helper.save(self.path, self.data)
-    
+
     def _initData(self):
+        source = type(self).__name__
+        if not self.cached:
+            self.data = self._download(self.start, self.end)   # download once, for other TF we can calculate from the downloaded data
+            return
+        gaps = self.store.missing(self.start, self.end)
+        count(f"store.{source}.{'miss' if gaps else 'hit'}")
+        for gap_start, gap_end in gaps:
+            Helper.log(f"{self.symbol}: downloading missing {gap_start} - {gap_end}")
+            try:
+                data = self._download(gap_start, gap_end)
+            except DateRangeException:
+                data = None     # no trading days in the gap
+            self.store.add(data, gap_start, gap_end, write=False)
+        if gaps:
+            self.store.save()
+        self.data = self.store.get(self.start, self.end)
+
+    def _download(self, start, end) -> dict:
         raise NotImplementedError
+
+    def df1(self) -> pd.DataFrame:
+        """ 1 minute dataframe from start, decoded once per download and kept """
+        if self._df1 is None:
+            self._df1 = Helper.dfForRange(Helper.jsonTypeAtoDf(self.data), self.start)
+        return self._df1
         
     def df(self, tf):
         raise NotImplementedError
 
 
 
-
-
 ### Downloaders
 
 ## 
@@ -283,10 +658,13 @@ class Downloader:
 ##
 
 class ETHelper:
+    window_days    = 30      # days per request when downloading long ranges
+    window_workers = 4
+    stock_symbols  = set()
     @staticmethod
     def getUrl(url: str) -> dict:
-        res = Helper.getUrl(url)
-        json = res.json()
+        res = Helper.getUrl(url, datasource="ET")
+        json = Helper.parseJson(res)
         if json["s"] != "ok":
             raise DownloadedDataException()
         if json["noData"]:
@@ -299,10 +677,14 @@ class ETHelper:
             countsback from end to start.
             type = index, stock
         """
-        base_url = "https://etelection.indiatimes.com/ET_Charts/india-market/{type}/history?symbol={symbol}&resolution={timeframe}&to={end}&countback={countback}&currencyCode=INR"
         start_epoch = Helper.getEpochStart(start)
         end_epoch = Helper.getEpochEnd(end)
-        countback = Helper.genApproxCountbackFromEpoch(start_epoch, end_epoch)
+        return ETHelper.genUrlUsingEpoch(type_, symbol, start_epoch, end_epoch, tf=tf)
+
+    @staticmethod
+    def genUrlUsingEpoch(type_, symbol, start_epoch, end_epoch, tf=1):
+        base_url = "https://etelection.indiatimes.com/ET_Charts/india-market/{type}/history?symbol={symbol}&resolution={timeframe}&to={end}&countback={countback}&currencyCode=INR"
+        countback = max(1, Helper.genApproxCountbackFromEpoch(start_epoch, end_epoch))
         return base_url.format(type=type_, symbol=symbol, timeframe=tf, end=end_epoch, countback=countback)
 
     @staticmethod
@@ -316,39 +698,45 @@ class ETHelper:
     @staticmethod
     def download(symbol, start, end, tf=1):
         """ stocks have EQ in their name in ET"""
-        try:
-            url = ETHelper.genIndexUrl(symbol, start, end, tf=tf)
-            return ETHelper.getUrl(url)
-        except:
-            url = ETHelper.genStockUrl(f"{symbol}EQ", start, end, tf=tf)
-            return ETHelper.getUrl(url)
+        if symbol not in ETHelper.stock_symbols:
+            try:
+                url = ETHelper.genIndexUrl(symbol, start, end, tf=tf)
+                return ETHelper.getUrl(url)
+            except:
+                pass
+        url  = ETHelper.genStockUrl(f"{symbol}EQ", start, end, tf=tf)
+        json = ETHelper.getUrl(url)
+        ETHelper.stock_symbols.add(symbol)   # next windows of this symbol skip the index url
+        return json
+
+    @staticmethod
+    def downloadUsingEpoch(symbol, start_epoch, end_epoch, tf=1):
+        """ download() for an epoch range, used by Live polls """
+        if symbol not in ETHelper.stock_symbols:
+            try:
+                return ETHelper.getUrl(ETHelper.genUrlUsingEpoch("index", symbol, start_epoch, end_epoch, tf=tf))
+            except:
+                pass
+        json = ETHelper.getUrl(ETHelper.genUrlUsingEpoch("stock", f"{symbol}EQ", start_epoch, end_epoch, tf=tf))
+        ETHelper.stock_symbols.add(symbol)
+        return json
 
 
 class ET(Downloader):
     def __init__(self, symbol, start, end, cached=False):
         super().__init__(symbol, start, end, cached)
-        
-    def _initData(self):
-        try:
-            if self.cached:
-                self._loadData()
-            else:
-                raise Exception()
-        except:
-            self.data   = self.__download()   # download once, for other TF we can calculate from the downloaded data
-            self._saveData()
-            
-    def __download(self):
-        return ETHelper.download(self.symbol, self.start, self.end, 1)
+
+    def _download(self, start, end):
+        return Helper.downloadInWindows(lambda start, end: ETHelper.download(self.symbol, start, end, 1),
+                                        start, end, ETHelper.window_days, ETHelper.window_workers)
     
     def df(self, tf):
         tf = int(tf)
-        df   = Helper.jsonTypeAtoDf(self.data)
-        df   = Helper.removeRowsBeforeDate(df, self.start)
+        df   = self.df1()
         if tf == 1:
             return df
         else:
-            return Helper.removeRowsAfterDate(Helper.getGroupedDf(df, tf), self.end)
+            return Helper.dfForRange(Helper.getGroupedDf(df, tf), end=self.end)
         
     
 ##
@@ -357,6 +745,8 @@ class ET(Downloader):
 
 class MCHelper:
     datetime_format = "%Y-%m-%d %H:%M"
+    window_days     = 30      # days per request when downloading long ranges
+    window_workers  = 4
     headers = {
             "Host": "priceapi.moneycontrol.com",
             "User-Agent"               : "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0",
@@ -372,17 +762,27 @@ class MCHelper:
             "Sec-Fetch-User"           : "?1",
             "Sec-GPC"                  : "1"
             }
+    # index code map: memoised per process, stored in a snapshot file for cold starts,
+    # refreshed on a background thread once older than index_code_map_ttl seconds.
+    index_code_map_ttl      = 7 * 24 * 3600
+    index_code_map_snapshot = "./instrument_data/mc_index_codes.json"
+    _index_code_map         = None
+    _index_code_map_time    = 0
+    _index_code_map_lock    = threading.RLock()     # held across the cold load, which refreshes under it
+    _index_code_map_refresh = None
+
     @staticmethod
     def getIndexCodeMap():
         """
         Moneycontrol has codes for indexes.
         From the said url, this extracts the indexes and the corresponding code.
+        Always downloads and parses the page, see getMemoisedIndexCodeMap.
         
         Returns:
-            Dict[str, str]: _description_
+            Dict[str, str]: index name (upper and lower case) -> code
         """
         url            = "https://www.moneycontrol.com/markets/indian-indices/"
-        soup           = Helper.getCachedSoup(url)
+        soup           = bs(Helper.getUrl(url, datasource="MC").text, 'html.parser')
         classes        = soup.find_all(class_="indicesList")
         index_code_map = {}
         for class_ in classes:
@@ -392,6 +792,68 @@ class MCHelper:
             index_code_map[index_name] = index_code
             index_code_map[index_name.lower()] = index_code
         return index_code_map
+
+    @staticmethod
+    def _readIndexCodeMapSnapshot():
+        try:
+            with open(Helper.getPathWhereThisScriptIsExecuting(MCHelper.index_code_map_snapshot), "r") as fp:
+                snapshot = json.load(fp)
+            return snapshot["codes"], snapshot["time"]
+        except (OSError, ValueError, KeyError):
+            return None, 0
+
+    @staticmethod
+    def _writeIndexCodeMapSnapshot(codes, fetched):
+        path = Helper.getPathWhereThisScriptIsExecuting(MCHelper.index_code_map_snapshot)
+        tmp  = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(tmp, "w") as fp:
+                json.dump({"time": fetched, "codes": codes}, fp, indent=1, sort_keys=True)
+            os.replace(tmp, path)
+        except OSError as e:
+            Helper.log(f"could not store index code snapshot: {e}")
+
+    @staticmethod
+    def refreshIndexCodeMap():
+        """ downloads the index code map and updates the memo and the snapshot """
+        codes   = MCHelper.getIndexCodeMap()
+        fetched = time.time()
+        if codes:
+            with MCHelper._index_code_map_lock:
+                MCHelper._index_code_map, MCHelper._index_code_map_time = codes, fetched
+            MCHelper._writeIndexCodeMapSnapshot(codes, fetched)
+        return codes
+
+    @staticmethod
+    def _refreshInBackground():
+        def refresh():
+            try:
+                MCHelper.refreshIndexCodeMap()
+            except Exception as e:
+                Helper.log(f"index code map refresh failed: {e}")
+
+        with MCHelper._index_code_map_lock:
+            if MCHelper._index_code_map_refresh is not None and MCHelper._index_code_map_refresh.is_alive():
+                return
+            MCHelper._index_code_map_refresh = threading.Thread(target=refresh, daemon=True)
+            MCHelper._index_code_map_refresh.start()
+
+    @staticmethod
+    def getMemoisedIndexCodeMap():
+        """
+        index code map from memory, else the snapshot file, else the web; a stale map is refreshed in the background.
+        A cold load happens once, callers arriving meanwhile wait for it.
+        """
+        if MCHelper._index_code_map is None:
+            with MCHelper._index_code_map_lock:
+                if MCHelper._index_code_map is None:
+                    codes, fetched = MCHelper._readIndexCodeMapSnapshot()
+                    if not codes:
+                        return MCHelper.refreshIndexCodeMap()
+                    MCHelper._index_code_map, MCHelper._index_code_map_time = codes, fetched
+        if time.time() - MCHelper._index_code_map_time > MCHelper.index_code_map_ttl:
+            MCHelper._refreshInBackground()
+        return MCHelper._index_code_map
     
     @staticmethod
     def getCodeForIndex(index):
@@ -403,15 +865,15 @@ class MCHelper:
             if index.upper() == "MIDCAP":
                 return 27
             index_name = Helper.officialNamesOfIndex(index)
-            return MCHelper.getIndexCodeMap()[index_name]
+            return MCHelper.getMemoisedIndexCodeMap()[index_name]
         except Exception as e:
-            print("Error : {}".format(e))
+            logger.debug("index code of %s not found: %r", index, e)
             raise IndexNotFoundException()
 
     @staticmethod
     def getUrl(url: str) -> dict:
-        res  = Helper.getUrl(url, headers=MCHelper.headers)
-        json = res.json()
+        res  = Helper.getUrl(url, headers=MCHelper.headers, datasource="MC")
+        json = Helper.parseJson(res)
         if "error" in json["s"]:
             raise DownloadedDataException()
         if json["s"] == "no_data":
@@ -425,10 +887,14 @@ class MCHelper:
         url = https://priceapi.moneycontrol.com/techCharts/indianMarket/stock/history?symbol={symbol}&resolution={timeframe}&from={start}&to={end}&countback=1&currencyCode=INR
         Difference with index url: it gives number of countback candle OHLC from "to" with the given "resolution". 
         """
-        base_url    = "https://priceapi.moneycontrol.com/techCharts/indianMarket/stock/history?symbol={symbol}&resolution={timeframe}&to={end}&countback={countback}"
         start_epoch = Helper.getEpochStart(start) #math.trunc(time.mktime(time.strptime(str(start) + " 9:15", MCHelper.datetime_format)))
         end_epoch   = Helper.getEpochEnd(end) #math.trunc(time.mktime(time.strptime(str(end) + " 15:30", MCHelper.datetime_format)))
-        countback   = Helper.genApproxCountbackFromEpoch(start_epoch, end_epoch)
+        return MCHelper.genStockUrlUsingEpoch(symbol, start_epoch, end_epoch)
+
+    @staticmethod
+    def genStockUrlUsingEpoch(symbol: str, start_epoch: int, end_epoch: int) -> str:
+        base_url    = "https://priceapi.moneycontrol.com/techCharts/indianMarket/stock/history?symbol={symbol}&resolution={timeframe}&to={end}&countback={countback}"
+        countback   = max(1, Helper.genApproxCountbackFromEpoch(start_epoch, end_epoch))
         url         = base_url.format(symbol=symbol, end=end_epoch, timeframe="1", countback=countback)
         return url
 
@@ -471,8 +937,8 @@ class MCHelper:
         try:
             return MCHelper.getUrl(url)
         except DateRangeException:
-            res               = Helper.getUrl(url, MCHelper.headers)
-            json              = res.json()
+            res               = Helper.getUrl(url, MCHelper.headers, datasource="MC")
+            json              = Helper.parseJson(res)
             fixed_end_epoch   = int(json["nextTime"])
             fixed_start_epoch = fixed_end_epoch - (24 * 60 * 60 - 1)  #* at this point, we are moving a day back from the last data point, just a second less.
             url               = MCHelper.genIndexUrlUsingEpoch(symbol, fixed_start_epoch, fixed_end_epoch)
@@ -482,32 +948,33 @@ class MCHelper:
     def downloadStock(symbol, start, end)->dict:
         url = MCHelper.genStockUrl(symbol, start, end)
         return MCHelper.getUrl(url)
+
+    @staticmethod
+    def downloadUsingEpoch(symbol, start_epoch, end_epoch)->dict:
+        """ index, else stock bars of an epoch range, used by Live polls """
+        try:
+            return MCHelper.getUrl(MCHelper.genIndexUrlUsingEpoch(symbol, start_epoch, end_epoch))
+        except IndexNotFoundException:
+            return MCHelper.getUrl(MCHelper.genStockUrlUsingEpoch(symbol, start_epoch, end_epoch))
     
 
 class MC(Downloader):
     def __init__(self, symbol, start, end, cached=False):
         super().__init__(symbol, start, end, cached)
-        
-    def _initData(self):
-        try:
-            if self.cached:
-                self._loadData()
-            else:
-                raise Exception()
-        except:
-            self.data   = self.__download()   # download once, for other TF we can calculate from the downloaded data
-            self._saveData()
-            
-    def __download(self):
+
+    def _download(self, start, end):
+        return Helper.downloadInWindows(self.__downloadWindow, start, end,
+                                        MCHelper.window_days, MCHelper.window_workers)
+
+    def __downloadWindow(self, start, end):
         try:
-            return MCHelper.downloadIndex(self.symbol, self.start, self.end)
+            return MCHelper.downloadIndex(self.symbol, start, end)
         except IndexNotFoundException:
-            return MCHelper.downloadStock(self.symbol, self.start, self.end)
+            return MCHelper.downloadStock(self.symbol, start, end)
 
     def df(self, tf):
         tf = int(tf)
-        df   = Helper.jsonTypeAtoDf(self.data)
-        df   = Helper.removeRowsBeforeDate(df, self.start)
+        df   = self.df1()
         if tf == 1:
             return df
         else:
@@ -515,29 +982,180 @@ class MC(Downloader):
 
 
 
+class Live:
+    """
+    intraday polling of one symbol: every poll() downloads only the bars from the last one seen onwards
+    (that one is still forming and gets revised) and updates the 1 minute and higher timeframe candles in place.
+    live = Live("BANKNIFTY", timeframes=[1, 5, 15])
+    while market_open: live.poll(); live.df(5); time.sleep(60)
+    """
+    datasources = ["MC", "ET"]
+
+    def __init__(self, symbol, timeframes=(1, 3, 5, 15, 30, 60), datasource="MC", date=None):
+        if datasource not in Live.datasources:
+            logger.error("live datasource %s not available, see Live.datasources", datasource)
+            raise DatasourceNotAvailableException()
+        self.symbol     = symbol
+        self.datasource = datasource
+        self.date       = date or time.strftime("%Y-%m-%d")
+        self.bars       = LiveBars(timeframes, SESSION_OPEN)
+        self.last_epoch = None      # utc epoch of the last bar seen
+
+    def _download(self, start_epoch, end_epoch) -> dict:
+        if self.datasource == "ET":
+            return ETHelper.downloadUsingEpoch(self.symbol, start_epoch, end_epoch)
+        return MCHelper.downloadUsingEpoch(self.symbol, start_epoch, end_epoch)
+
+    def poll(self) -> int:
+        """ returns: number of 1 minute bars added or revised """
+        start = self.last_epoch if self.last_epoch is not None else Helper.getEpochStart(self.date)
+        end   = min(int(time.time()), Helper.getEpochEnd(self.date))
+        if end <= start:
+            return 0
+        with timed(f"live.{self.datasource}"):
+            try:
+                # one bar further back: the countback floor((end - start) / 60) alone stops a bar short of
+                # the forming one, which then never gets its final ohlc
+                df = Helper.jsonTypeAtoDf(self._download(start - 60, end))
+            except DateRangeException:
+                return 0
+        df = df[df["epoch"].to_numpy() >= start]       # countback urls may reach further back
+        if df.empty:
+            return 0
+        changed         = self.bars.update(df.index.values.astype("datetime64[s]").astype(np.int64),
+                                           {name: df[name].to_numpy() for name in OHLCV})
+        self.last_epoch = int(df["epoch"].iloc[-1])
+        count("live.bars", changed)
+        return changed
+
+    def df(self, tf=1) -> pd.DataFrame:
+        return self.bars.df(tf)
+
+
 ##
 # UPSTOX
 ##
 
+class InstrumentIndex:
+    """
+    instrument_key lookup over an Upstox instruments csv, built once and stored next to it ({csv}.idx.pkl)
+    as plain dicts, lists and arrays, so the stored copy does not depend on the module path that wrote it.
+    Lookup order: exact name, exact tradingsymbol, exact isin, then normalised (alphanumeric, upper case)
+    prefix of name and tradingsymbol, and finally a substring scan; the first row of the csv wins on ties.
+    """
+    version = 2
+    fields  = ["name", "tradingsymbol", "isin"]
+    prefix_fields = ["name", "tradingsymbol"]
+
+    def __init__(self, df: pd.DataFrame):
+        self.keys   = df["instrument_key"].astype(str).tolist()
+        self.exact  = {}
+        self.prefix = {}
+        self.upper  = {}
+        for field in InstrumentIndex.fields:
+            if field not in df.columns:
+                continue
+            values = df[field].where(df[field].notna(), "").astype(str).tolist()
+            exact  = {}
+            for row, value in enumerate(values):
+                if value:
+                    exact.setdefault(value.strip().upper(), row)
+            self.exact[field] = exact
+            if field in InstrumentIndex.prefix_fields:
+                normalised          = [InstrumentIndex.normalise(value) for value in values]
+                order               = sorted(range(len(values)), key=lambda row: (normalised[row], row))
+                self.prefix[field]  = ([normalised[row] for row in order], np.asarray(order, dtype=np.int64))
+                self.upper[field]   = np.asarray([value.upper() for value in values])
+
+    def state(self) -> dict:
+        return {"keys": self.keys, "exact": self.exact, "prefix": self.prefix, "upper": self.upper}
+
+    @staticmethod
+    def fromState(state: dict):
+        index = InstrumentIndex.__new__(InstrumentIndex)
+        index.keys, index.exact, index.prefix, index.upper = (state[name] for name in ("keys", "exact", "prefix", "upper"))
+        return index
+
+    @staticmethod
+    def normalise(value: str) -> str:
+        return re.sub(r"[^0-9A-Z]", "", str(value).upper())
+
+    def _prefix(self, field, symbol):
+        normalised, rows = self.prefix[field]
+        query = InstrumentIndex.normalise(symbol)
+        if not query:
+            return None
+        lo = bisect.bisect_left(normalised, query)
+        hi = bisect.bisect_left(normalised, query + "\uffff", lo)
+        return int(rows[lo:hi].min()) if hi > lo else None
+
+    def _contains(self, field, symbol):
+        found = np.flatnonzero(np.char.find(self.upper[field], symbol.upper()) >= 0)
+        return int(found[0]) if len(found) else None
+
+    def find(self, symbol):
+        """ instrument_key of symbol or None """
+        key = str(symbol).strip().upper()
+        for field in InstrumentIndex.fields:
+            row = self.exact.get(field, {}).get(key)
+            if row is not None:
+                return self.keys[row]
+        for lookup in (self._prefix, self._contains):
+            for field in InstrumentIndex.prefix_fields:
+                if field in self.prefix:
+                    row = lookup(field, symbol)
+                    if row is not None:
+                        return self.keys[row]
+        return None
+
+    @staticmethod
+    def load(filepath):
+        """ index of the csv at filepath, from its stored copy when the csv did not change; None if there is no csv """
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        stamp = (InstrumentIndex.version, stat.st_mtime, stat.st_size)
+        path  = filepath + ".idx.pkl"
+        try:
+            with open(path, "rb") as fp:
+                stored_stamp, state = pickle.load(fp)
+            if stored_stamp == stamp:
+                count("instrument_index.hit")
+                return InstrumentIndex.fromState(state)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError, ImportError, KeyError, TypeError):
+            pass
+        count("instrument_index.miss")
+        index = InstrumentIndex(pd.read_csv(filepath, sep=","))
+        try:
+            tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(tmp, "wb") as fp:
+                pickle.dump((stamp, index.state()), fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError as e:
+            Helper.log(f"could not store instrument index: {e}")
+        return index
+
+
 class UpstoxHelper:
     nse_instruments = None
     bse_instruments = None
+    instrument_files = {"NSE": "./instrument_data/NSE.csv", "BSE": "./instrument_data/BSE.csv"}
     
     @staticmethod
     def getUrl(url):
         headers = {
             'Accept': 'application/json'
         }
-        res             = Helper.getUrl(url, headers=headers)
-        print(res)
-        json            = res.json()
+        res             = Helper.getUrl(url, headers=headers, datasource="Upstox")
+        json            = Helper.parseJson(res)
         if json["status"] != "success":
             raise DownloadedDataException()
         return json["data"]["candles"]
     
     @staticmethod
     def readInstrumentsFile(filepath) -> pd.DataFrame:
-        return pd.read_csv(Helper.getPathWhereThisScriptIsExecuting(filepath), sep=",", engine='python')
+        return pd.read_csv(Helper.getPathWhereThisScriptIsExecuting(filepath), sep=",")
     
     @staticmethod
     def getInstrumentKeyFromDataframe(df, symbol):
@@ -551,30 +1169,36 @@ class UpstoxHelper:
     @staticmethod
     def removeArtifactsFromInstrumentKey(instrument_key):
         return instrument_key.replace(" ", "%20").replace("|", "%7C")
-    
+
     @staticmethod
-    def getNseInstrument(symbol):
+    def getInstrumentIndexes() -> list:
+        """ [NSE index, BSE index], loaded once per process """
         if UpstoxHelper.nse_instruments is None:
-            UpstoxHelper.nse_instruments = UpstoxHelper.readInstrumentsFile("./instrument_data/NSE.csv") 
-            instrument_key = UpstoxHelper.getInstrumentKeyFromDataframe(UpstoxHelper.nse_instruments, symbol)[0]
-        return UpstoxHelper.removeArtifactsFromInstrumentKey(instrument_key)
-    
-    @staticmethod
-    def getBseInstrument(symbol):
+            UpstoxHelper.nse_instruments = InstrumentIndex.load(Helper.getPathWhereThisScriptIsExecuting(UpstoxHelper.instrument_files["NSE"]))
         if UpstoxHelper.bse_instruments is None:
-            UpstoxHelper.bse_instruments = UpstoxHelper.readInstrumentsFile("./instrument_data/BSE.csv") 
-            instrument_key = UpstoxHelper.getInstrumentKeyFromDataframe(UpstoxHelper.bse_instruments, symbol)[0]
-        return UpstoxHelper.removeArtifactsFromInstrumentKey(instrument_key)
+            UpstoxHelper.bse_instruments = InstrumentIndex.load(Helper.getPathWhereThisScriptIsExecuting(UpstoxHelper.instrument_files["BSE"]))
+        return [index for index in (UpstoxHelper.nse_instruments, UpstoxHelper.bse_instruments) if index is not None]
+
+    @staticmethod
+    def resolve(symbols) -> dict:
+        """ {symbol: url ready instrument key or None}, NSE first then BSE """
+        indexes  = UpstoxHelper.getInstrumentIndexes()
+        resolved = {}
+        for symbol in symbols:
+            resolved[symbol] = None
+            for index in indexes:
+                key = index.find(symbol)
+                if key is not None:
+                    resolved[symbol] = UpstoxHelper.removeArtifactsFromInstrumentKey(key)
+                    break
+        return resolved
     
     @staticmethod
     def getInstrumentKey(symbol):
-        inst_key = UpstoxHelper.getNseInstrument(symbol)
-        Helper.log(f"nse_instrument_key: {inst_key}")
-        if inst_key is None:
-            inst_key = UpstoxHelper.getBseInstrument(symbol)
+        inst_key = UpstoxHelper.resolve([symbol])[symbol]
         if inst_key is None:
             raise InstrumentKeyNotFoundException()
-        Helper.log(f"bse_instrument_key: {inst_key}")
+        Helper.log(f"instrument_key: {inst_key}")
         return inst_key
             
     
@@ -603,14 +1227,16 @@ class Upstox:
         self.symbol = UpstoxHelper.officialNamesOfIndex(symbol)
         self.start  = start
         self.end    = end
+        self.dfs    = {}    # downloads per upstox interval
     
     def __download(self, tf):
         url = UpstoxHelper.genUrl(self.symbol, self.start, self.end, tf)
         return UpstoxHelper.getUrl(url)
     
     def __df(self, tf):
-        data = self.__download(tf)
-        return Helper.listOfListsToDf(data)
+        if tf not in self.dfs:
+            self.dfs[tf] = Helper.listOfListsToDf(self.__download(tf))
+        return self.dfs[tf]
     
     def dfDaily(self):
         return self.__df("day")
@@ -632,33 +1258,173 @@ class Upstox:
 # PUBLIC METHODS / API:
 ##
 class HistoricalData:
-    DATASOURCE = "MC"
-    def __init__(self, symbol, start, end):
-        self.datasource_obj = self.__initDatasourceObj(symbol, start, end)
+    DATASOURCE  = "MC"
+    # per datasource limits of all requests, also those of bulk(): requests in flight and requests started per second.
+    # the same dicts as Helper.concurrency and Helper.rate_limit
+    CONCURRENCY = Helper.concurrency
+    RATE_LIMIT  = Helper.rate_limit
+    # hedge=True: the preferred datasource is asked first, the next one after HEDGE_AFTER seconds or on error,
+    # the first valid answer wins. Preference is HEDGE_ORDER re-sorted by the measured latency of each datasource.
+    HEDGE_ORDER   = ["MC", "ET", "Upstox"]
+    HEDGE_AFTER   = 5.0
+    LATENCY_ALPHA = 0.3     # weight of the newest sample in the moving average
+    _latency      = {}      # datasource -> moving average of seconds per download, failures count as 2 * HEDGE_AFTER
+    _latency_lock = threading.Lock()
+
+    def __init__(self, symbol, start, end, datasource=None, hedge=False):
+        self.hedge = hedge
+        if hedge:
+            self.datasource, self.datasource_obj = HistoricalData._hedged(symbol, start, end)
+        else:
+            self.datasource     = datasource or HistoricalData.DATASOURCE
+            self.datasource_obj = self.__initDatasourceObj(symbol, start, end)
+
+    @staticmethod
+    def bulk(symbols, start, end, datasource=None):
+        """
+        downloads many symbols concurrently, CONCURRENCY of them at once. Every request, of any window of any
+        symbol, stays within the CONCURRENCY and RATE_LIMIT of the datasource. A failing symbol does not stop the others.
+        Yields:
+            (symbol, HistoricalData or None, exception or None) in the order downloads complete
+        """
+        datasource = datasource or HistoricalData.DATASOURCE
+
+        def download(symbol):
+            return HistoricalData(symbol, start, end, datasource)
+
+        symbols = list(symbols)
+        workers = max(1, min(len(symbols), HistoricalData.CONCURRENCY.get(datasource, 1)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(download, symbol): symbol for symbol in symbols}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result(), None
+                except Exception as e:
+                    yield futures[future], None, e
+
+    @staticmethod
+    def _recordLatency(datasource, seconds, ok):
+        sample = seconds if ok else max(seconds, 2 * HistoricalData.HEDGE_AFTER)
+        with HistoricalData._latency_lock:
+            last = HistoricalData._latency.get(datasource)
+            HistoricalData._latency[datasource] = sample if last is None else \
+                last + HistoricalData.LATENCY_ALPHA * (sample - last)
+
+    @staticmethod
+    def latencies() -> dict:
+        """ datasource -> moving average of seconds per download """
+        with HistoricalData._latency_lock:
+            return dict(HistoricalData._latency)
+
+    @staticmethod
+    def preferredDatasources() -> list:
+        """ HEDGE_ORDER sorted by measured latency, a datasource not measured yet counts as HEDGE_AFTER """
+        latency = HistoricalData.latencies()
+        return sorted(HistoricalData.HEDGE_ORDER, key=lambda source: latency.get(source, HistoricalData.HEDGE_AFTER))
+
+    @staticmethod
+    def _fetch(datasource, symbol, start, end):
+        """ datasource object whose 1 minute data is downloaded and not empty """
+        started = time.monotonic()
+        try:
+            obj = HistoricalData(symbol, start, end, datasource).datasource_obj
+            if obj.df(1).empty:
+                raise DateRangeException()
+        except Exception:
+            HistoricalData._recordLatency(datasource, time.monotonic() - started, False)
+            raise
+        HistoricalData._recordLatency(datasource, time.monotonic() - started, True)
+        return obj
+
+    @staticmethod
+    def _hedged(symbol, start, end):
+        """
+        returns (datasource, datasource object) of the first valid download.
+        Downloads still running when one wins are left to finish in the background and their result is dropped,
+        queued ones are cancelled. When all fail, the error of the most preferred datasource is raised.
+        """
+        order   = HistoricalData.preferredDatasources()
+        pool    = ThreadPoolExecutor(max_workers=len(order))
+        pending = {}
+        errors  = {}
+        try:
+            for position, datasource in enumerate(order):
+                pending[pool.submit(HistoricalData._fetch, datasource, symbol, start, end)] = datasource
+                if position:
+                    logger.info("%s: hedging to %s", symbol, datasource)
+                    count("hedge.fallback")
+                last = position == len(order) - 1
+                while pending:
+                    done, _ = wait(pending, timeout=None if last else HistoricalData.HEDGE_AFTER,
+                                   return_when=FIRST_COMPLETED)
+                    if not done:
+                        break       # too slow, ask the next datasource as well
+                    for future in done:
+                        source = pending.pop(future)
+                        try:
+                            obj = future.result()
+                        except Exception as e:
+                            logger.info("%s: %s failed: %r", symbol, source, e)
+                            errors[source] = e
+                            continue
+                        count(f"hedge.win.{source}")
+                        return source, obj
+                    if not last:
+                        break       # failed, ask the next datasource right away
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+        raise next(errors[source] for source in order if source in errors)
+
+    @staticmethod
+    def iterDays(symbol, start, end, tf, window_days=7, prefetch_windows=1):
+        """
+        yields (date, dataframe) from start to end in chronological order, downloading window_days at a time.
+        The next windows are downloaded on a background thread while the current one is consumed,
+        so only a few windows are held in memory for any range.
+        """
+        def windows():
+            for window_start, window_end in Helper.splitDateRange(start, end, window_days):
+                try:
+                    df = HistoricalData(symbol, window_start, window_end).df(tf)
+                except DateRangeException:
+                    continue    # holidays / weekends only
+                yield window_start, window_end, df
+
+        for window_start, window_end, df in prefetch(windows(), depth=prefetch_windows):
+            yield from iterDayFrames(df, window_start, window_end)
 
     def currentDatasource(self):
-        return HistoricalData.DATASOURCE
+        return self.datasource
     
     def allDatasources(self):
         return ["MC", "ET", "Upstox"]
     
     def setDatasource(self, datasource):
+        """ default datasource of new objects and the one this object reports; data already downloaded is kept """
         HistoricalData.DATASOURCE = datasource
+        self.datasource           = datasource
     
     def __initDatasourceObj(self, symbol, start, end):
-        if HistoricalData.DATASOURCE == "MC":
+        if self.datasource == "MC":
             return MC(symbol, start, end)
-        elif HistoricalData.DATASOURCE == "ET":
+        elif self.datasource == "ET":
             return ET(symbol, start, end)
-        elif HistoricalData.DATASOURCE == "Upstox":
+        elif self.datasource == "Upstox":
             return Upstox(symbol, start, end)
         else:
-            print(".allDatasources for list of datasources supported")
+            logger.error("datasource %s not available, see .allDatasources", self.datasource)
             raise DatasourceNotAvailableException()
     
     def df(self, tf):
+        """ hedged downloads are normalised to OHLCV columns, as the datasource is not known upfront """
+        if self.hedge:
+            return Helper.normaliseDf(self.datasource_obj.df(tf))
         return self.datasource_obj.df(tf)
 
     def dfForDate(self, date, tf):
-        """ returns: dict_ [date] = dataframe"""
-        return Helper.mapDfToPerDay(self.df(tf))[date]
+        """ returns: dataframe of date """
+        return Helper.dfForDate(self.df(tf), date)
+
+    def getRange(self, start=None, end=None, tf=1):
+        """ returns: dataframe of [start, end], dates or date times, both inclusive """
+        return Helper.dfForRange(self.df(tf), start, end)
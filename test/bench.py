@@ -0,0 +1,251 @@
+"""
+benchmarks of the load, decode, resample and per day split hot paths on synthetic data.
+
+python bench.py                    # run and compare with bench_baseline.json
+python bench.py --save-baseline    # run and store the results as the new baseline
+python bench.py --years 1          # smaller data set
+
+Warm benchmarks report the best of --repeat runs, each run looping the benchmark until it took MIN_SAMPLE seconds;
+cold / first call benchmarks report the median of --cold-runs runs, each on fresh state. Alongside: rows per second
+and peak python memory (tracemalloc).
+A benchmark slower than --tolerance times its baseline is measured again, up to RECHECKS times keeping its best time,
+and is a regression when it stays slower; regressions make the script exit with 1.
+The inputs are generated for fixed dates (ARCHIVE_END); the baseline stores the parameters and input rows it was run
+with, a run with other ones is not compared (exit 2). --save-baseline keeps the median of BASELINE_ROUNDS full runs.
+"""
+import sys
+import os
+import json
+import time
+import shutil
+import statistics
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+sys.path.append(str(Path(__file__).absolute().parent.parent))
+
+import numpy as np
+import pandas as pd
+
+from ohlc_online import Helper
+from ohlc_offline import BnfOfflineDataSource
+
+BASELINE  = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+MONTHS    = ["JAN", "FEB", "MAR", "APR", "MAY", "JUNE", "JULY", "AUG", "SEP", "OCT", "NOV", "DEC"]
+IST       = 19800
+MIN_SAMPLE = 0.2        # seconds a warm sample loops for, so millisecond benchmarks are not timer noise
+ARCHIVE_END = "2025-01-01"   # fixed, so the inputs do not change with the run date
+JSON_DAYS  = 250
+LOL_DAYS   = 120
+BASELINE_ROUNDS = 3     # full runs a saved baseline is the median of, so one fast moment does not set the bar
+RECHECKS   = 2          # re-runs of a benchmark that looks like a regression before it is reported as one
+
+
+## synthetic data ##
+def genMinutes(start, end):
+    """ wall-clock epochs of 09:15 .. 15:29 bar starts of every weekday in [start, end] """
+    days    = pd.bdate_range(start, end).values.astype("datetime64[s]").astype(np.int64)
+    minutes = np.arange(9 * 60 + 15, 15 * 60 + 30) * 60
+    return (days[:, None] + minutes[None, :]).ravel()
+
+def genPrices(n, seed=0):
+    rng   = np.random.default_rng(seed)
+    close = 35000 + np.cumsum(rng.normal(0, 5, n))
+    open_ = np.r_[close[0], close[:-1]]
+    high  = np.maximum(open_, close) + rng.random(n) * 3
+    low   = np.minimum(open_, close) - rng.random(n) * 3
+    return open_, high, low, close
+
+def archiveMinutes(years):
+    """ bar end epochs of the years before ARCHIVE_END """
+    end   = pd.Timestamp(ARCHIVE_END)
+    start = end - pd.DateOffset(years=years)
+    return genMinutes(start, end - pd.Timedelta(days=1)) + 60
+
+def jsonMinutes(days):
+    """ bar start epochs (UTC) of days weekdays from 2023-01-02 """
+    return genMinutes("2023-01-02", pd.Timestamp("2023-01-02") + pd.offsets.BDay(days - 1)) - IST
+
+def inputRows(years) -> dict:
+    """ rows of every generated input, recorded with the baseline """
+    epoch = archiveMinutes(years)
+    return {"archive": len(epoch) + len(np.unique(epoch // 86400)),    # one pre-open row per day
+            "json": len(jsonMinutes(JSON_DAYS)), "list_of_lists": len(jsonMinutes(LOL_DAYS))}
+
+def writeTextArchive(directory, years, ticker="BNF", name="BANKNIFTY"):
+    """ monthly files in the data/ text format: bar end labelled rows, 09:08 pre-open row, 09:16 .. 15:30 """
+    epoch      = archiveMinutes(years)
+    o, h, l, c = genPrices(len(epoch))
+    # a 09:08 pre-open row in front of every day
+    first      = np.flatnonzero(np.r_[True, np.diff(epoch // 86400) != 0])
+    epoch      = np.insert(epoch, first, epoch[first] - 8 * 60)
+    o, h, l, c = (np.insert(col, first, o[first]) for col in (o, h, l, c))
+    pre        = first + np.arange(len(first))     # positions of the inserted rows
+    h[pre] = l[pre] = c[pre] = o[pre]
+    stamps     = pd.DatetimeIndex(epoch.astype("datetime64[s]"))
+    df         = pd.DataFrame({"ticker": name, "date": stamps.strftime("%Y%m%d"), "time": stamps.strftime("%H:%M"),
+                               "o": o, "h": h, "l": l, "c": c, "x": 0, "y": 0})
+    for (year, month), month_df in df.groupby([stamps.year, stamps.month]):
+        month_df.to_csv(os.path.join(directory, f"{year} {MONTHS[month - 1]} {ticker}.txt"),
+                        header=False, index=False, float_format="%.2f")
+    return len(epoch)
+
+def genJsonTypeA(days):
+    """ ET / MC shape: {s, t, o, h, l, c, v} with UTC epochs as python lists """
+    epoch      = jsonMinutes(days)
+    o, h, l, c = genPrices(len(epoch))
+    volume     = np.random.default_rng(1).integers(0, 1000, len(epoch))
+    return {"s": "ok", "t": epoch.tolist(), "o": o.tolist(), "h": h.tolist(), "l": l.tolist(), "c": c.tolist(), "v": volume.tolist()}
+
+def genListOfLists(days):
+    """ Upstox shape: [[iso time, o, h, l, c, v, oi], ...], newest first """
+    json  = genJsonTypeA(days)
+    times = pd.to_datetime(np.asarray(json["t"]) + IST, unit="s").strftime("%Y-%m-%dT%H:%M:%S+05:30")
+    rows  = [list(row) + [0] for row in zip(times, json["o"], json["h"], json["l"], json["c"], json["v"])]
+    return rows[::-1]
+
+
+## measuring ##
+def peakMemory(func):
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def measure(func, repeat):
+    """ best time per call of repeat samples, each looping func for at least MIN_SAMPLE seconds, and peak memory """
+    start = time.perf_counter()
+    func()
+    once  = time.perf_counter() - start
+    loops = max(1, int(MIN_SAMPLE / once) if once > 0 else 1000)
+    best  = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            func()
+        best  = min(best, (time.perf_counter() - start) / loops)
+    return best, peakMemory(func)
+
+def measureCold(setup, func, runs):
+    """ median time of runs calls of func, each on the fresh state setup() returns (setup is not timed) """
+    times = []
+    for _ in range(runs):
+        state = setup()
+        start = time.perf_counter()
+        func(state)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), peakMemory(lambda: func(setup()))
+
+def runBenchmarks(years, repeat, cold_runs, suspect=lambda name, seconds: False):
+    """ a benchmark for which suspect(name, seconds) holds is measured again, up to RECHECKS times, keeping its best time """
+    Helper.logging = False
+    results   = {}
+
+    def record(name, measurement, rows):
+        seconds, peak = measurement()
+        for _ in range(RECHECKS):
+            if not suspect(name, seconds):
+                break
+            seconds = min(seconds, measurement()[0])
+        results[name] = (seconds, peak, rows)
+
+    directory = tempfile.mkdtemp(prefix="ohlc_bench_")
+    try:
+        rows    = writeTextArchive(directory, years)
+        pattern = os.path.join(directory, "*BNF.txt")
+
+        def removeCache():
+            shutil.rmtree(os.path.join(directory, ".cache"), ignore_errors=True)
+
+        record("offline_construct_cold",
+               lambda: measureCold(removeCache, lambda _: BnfOfflineDataSource(filepath=pattern), cold_runs), rows)
+        record("offline_construct_warm", lambda: measure(lambda: BnfOfflineDataSource(filepath=pattern), repeat), rows)
+
+        source = BnfOfflineDataSource(filepath=pattern)
+        dates  = source.getDates()
+        for tf in [1, 3, 5, 15, 30, 60]:
+            record(f"offline_getDayData_{tf}m_first",
+                   lambda: measureCold(lambda: BnfOfflineDataSource(filepath=pattern),
+                                       lambda fresh: [fresh.getDayData(date, tf) for date in dates], cold_runs), rows)
+            record(f"offline_getDayData_{tf}m",
+                   lambda: measure(lambda: [source.getDayData(date, tf) for date in dates], repeat), rows)
+
+        json     = genJsonTypeA(days=JSON_DAYS)
+        n        = len(json["t"])
+        record("jsonTypeAtoDf", lambda: measure(lambda: Helper.jsonTypeAtoDf(json), repeat), n)
+        lol      = genListOfLists(days=LOL_DAYS)
+        record("listOfListsToDf", lambda: measure(lambda: Helper.listOfListsToDf(lol), repeat), len(lol))
+        df       = Helper.jsonTypeAtoDf(json)
+        for tf in [3, 15, 60]:
+            record(f"getGroupedDf_{tf}m", lambda: measure(lambda: Helper.getGroupedDf(df, tf), repeat), n)
+        grouped  = Helper.getGroupedDf(df, 5)
+        record("mapDfToPerDay", lambda: measure(lambda: [day for day in Helper.mapDfToPerDay(df).values()], repeat), n)
+        record("mapDfToPerDay_5m",
+               lambda: measure(lambda: [day for day in Helper.mapDfToPerDay(grouped).values()], repeat), len(grouped))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {name: {"seconds": seconds, "rows_per_second": rows / seconds if seconds else float("inf"), "peak_mb": peak / 1e6}
+            for name, (seconds, peak, rows) in results.items()}
+
+
+## reporting ##
+def report(results, baseline, tolerance):
+    regressions = []
+    print(f"{'benchmark':36} {'seconds':>10} {'rows/s':>14} {'peak MB':>10} {'baseline':>10} {'ratio':>7}")
+    for name, result in results.items():
+        base  = baseline.get(name, {}).get("seconds")
+        ratio = result["seconds"] / base if base else None
+        flag  = ""
+        if ratio is not None and ratio > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"{name:36} {result['seconds']:10.4f} {result['rows_per_second']:14,.0f} {result['peak_mb']:10.1f} "
+              f"{base if base else float('nan'):10.4f} {ratio if ratio else float('nan'):7.2f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="ohlc hot path benchmarks")
+    parser.add_argument("--years", type=int, default=3, help="years of synthetic 1 minute data for the offline source")
+    parser.add_argument("--repeat", type=int, default=3, help="samples per warm benchmark, the best one is reported")
+    parser.add_argument("--cold-runs", type=int, default=5, help="runs per cold benchmark, the median is reported")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="slowdown against the baseline reported as regression")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    params = {"years": args.years, "repeat": args.repeat, "cold_runs": args.cold_runs, "min_sample": MIN_SAMPLE,
+              "archive_end": ARCHIVE_END, "rows": inputRows(args.years)}
+    try:
+        with open(args.baseline, "r") as fp:
+            baseline = json.load(fp)
+    except (OSError, ValueError):
+        baseline = {}
+    comparable = baseline.get("params") == params
+    if not args.save_baseline and baseline and not comparable:
+        print(f"baseline was recorded with {baseline.get('params')}, this run uses {params}; "
+              f"run with the same parameters or --save-baseline")
+        sys.exit(2)
+
+    if args.save_baseline:
+        rounds  = [runBenchmarks(args.years, args.repeat, args.cold_runs) for _ in range(BASELINE_ROUNDS)]
+        results = {name: min((run[name] for run in rounds), key=lambda result: abs(
+                       result["seconds"] - statistics.median(run[name]["seconds"] for run in rounds)))
+                   for name in rounds[0]}
+        report(results, {}, args.tolerance)
+    else:
+        base        = baseline.get("results", {}) if comparable else {}
+        results     = runBenchmarks(args.years, args.repeat, args.cold_runs,
+                                    lambda name, seconds: name in base and seconds > args.tolerance * base[name]["seconds"])
+        regressions = report(results, base, args.tolerance)
+    if args.save_baseline:
+        with open(args.baseline, "w") as fp:
+            json.dump({"params": params, "results": results}, fp, indent=1, sort_keys=True)
+        print(f"baseline saved: {args.baseline}")
+    elif regressions:
+        print(f"regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
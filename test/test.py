@@ -37,3 +37,51 @@ try:
 except Exception as e:
     print(f"GenericClass - Error - {e}")
 
+
+# offline checks, no network: online and offline paths must give identical bars
+
+try:
+    import numpy as np
+    from ohlc_common import resample, LiveBars
+    from ohlc_offline import _repair
+
+    source = BnfOfflineDataSource(start="2022-03-01", end="2022-03-31")
+    # the same 1 minute bars as a downloader would decode them: utc epochs labelled by bar start
+    online = Helper.jsonTypeAtoDf({"t": source.epoch - 60 - 19800, "o": source.ohlc[:, 0], "h": source.ohlc[:, 1],
+                                   "l": source.ohlc[:, 2], "c": source.ohlc[:, 3], "v": np.zeros(len(source.epoch))})
+    for date in source.getDates()[:5]:
+        for tf in [1, 3, 5, 15, 30, 60]:
+            offline = source.getDayData(date, tf)[["Open", "High", "Low", "Close"]]
+            grouped = Helper.getGroupedDf(Helper.dfForDate(online, date), tf)[["Open", "High", "Low", "Close"]]
+            assert (offline.index == grouped.index).all(), (date, tf)
+            assert np.allclose(offline.to_numpy(), grouped.to_numpy()), (date, tf)
+    print("Offline == Online resample - OK")
+except Exception as e:
+    print(f"Offline == Online resample - Error - {e!r}")
+
+try:
+    epoch   = online["epoch"].to_numpy() + 19800
+    columns = {name: online[name].to_numpy() for name in ["Open", "High", "Low", "Close", "Volume"]}
+    live    = LiveBars([1, 5, 15])
+    n       = 406
+    for i in range(0, n, 7):                # ticks of a few bars at a time, the last one revised by the next tick
+        live.update(epoch[max(i - 1, 0):i + 7], {name: values[max(i - 1, 0):i + 7] for name, values in columns.items()})
+    for tf in [5, 15]:
+        bins, bars = resample(epoch[:n], {name: values[:n] for name, values in columns.items()}, tf)
+        df = live.df(tf)
+        assert (df.index.values.astype("datetime64[s]").astype(np.int64) == bins).all(), tf
+        assert all(np.allclose(df[name].to_numpy(), bars[name]) for name in ["Open", "High", "Low", "Close"]), tf
+    print("LiveBars == resample - OK")
+except Exception as e:
+    print(f"LiveBars == resample - Error - {e!r}")
+
+try:
+    day        = source.epoch // 86400 == source.epoch[0] // 86400
+    clean      = _repair(source.epoch[day], source.ohlc[day])
+    order      = np.r_[1, 0, np.arange(2, day.sum()), day.sum() - 1]       # out of order and a duplicate row
+    repaired   = _repair(source.epoch[day][order], source.ohlc[day][order])
+    assert (clean[0] == repaired[0]).all() and (clean[1] == repaired[1]).all()
+    assert repaired[2]["duplicates"][0] == 1 and repaired[2]["out_of_order"][0] == 1
+    print("Offline repair - OK")
+except Exception as e:
+    print(f"Offline repair - Error - {e!r}")